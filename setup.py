@@ -10,11 +10,11 @@ setup(
     packages=find_packages(),
     install_requires=[
         # "escriptorium-connector",
-        "minineedle",
-        "nltk",
+        "numpy",
         "pydantic",
         "python-dotenv",
     ],
+    entry_points={"console_scripts": ["escriptorium-collate-batch = escriptorium_collate.batch:main"]},
     setup_requires=["pytest-runner", "flake8"],
     tests_require=["pytest"],
 )
@@ -0,0 +1,147 @@
+import numpy as np
+
+try:
+    from typing import Dict, List, Tuple
+except ImportError:
+    from typing_extensions import Dict, List, Tuple
+
+MATCH = 1
+MISMATCH = -1
+GAP = -1
+
+DIAGONAL = 0
+UP = 1
+LEFT = 2
+
+GAP_CHARACTER = ""
+
+
+def _fast_path(a: List[str], b: List[str]) -> Tuple[List[str], List[str]] | None:
+    """
+    Align two token sequences whose lengths differ by one and that differ only
+    around a single position, i.e. where one token was split in two, two tokens
+    were merged, or a token was added. Return None for any other case.
+
+    Of the equally good alignments, the one whose gap comes first is returned,
+    as Needleman-Wunsch traced back from the end with matches preferred does:
+    e.g. a merged token is aligned with the second of the split tokens.
+    """
+    if abs(len(a) - len(b)) != 1:
+        return None
+    short, long = (a, b) if len(a) < len(b) else (b, a)
+
+    # Mismatches of short[:gap] against long[:gap], and of short[gap:] against long[gap + 1:].
+    before = [0] * (len(short) + 1)
+    for index, token in enumerate(short):
+        before[index + 1] = before[index] + (token != long[index])
+    after = [0] * (len(short) + 1)
+    for index in range(len(short) - 1, -1, -1):
+        after[index] = after[index + 1] + (short[index] != long[index + 1])
+    mismatches = [x + y for x, y in zip(before, after)]
+    if min(mismatches) > 1:
+        return None
+
+    gap = mismatches.index(min(mismatches))
+    short_aligned = short[:gap] + [GAP_CHARACTER] + short[gap:]
+    if short is a:
+        return short_aligned, list(long)
+    return list(long), short_aligned
+
+
+def align_batch(pairs: List[Tuple[List[str], List[str]]]) -> List[Tuple[List[str], List[str]]]:
+    """
+    Align many pairs of token sequences (e.g. the normalized and diplomatic
+    tokens of every line of a part) with Needleman-Wunsch in one call.
+
+    Pairs that differ around a single position (one split, merge or addition)
+    are aligned directly. All others are integer-encoded, padded, and aligned
+    together: every row of the DP matrix is computed for all pairs at once
+    with NumPy. Gaps are filled with empty strings.
+
+    Args:
+        pairs (List[Tuple[List[str], List[str]]]): Pairs of token sequences
+
+    Returns:
+        List[Tuple[List[str], List[str]]]: Aligned pairs of equal length
+    """
+    results: List[Tuple[List[str], List[str]] | None] = [None] * len(pairs)
+    pending = []
+    for index, (a, b) in enumerate(pairs):
+        if not a or not b:
+            length = max(len(a), len(b))
+            results[index] = (list(a) or [GAP_CHARACTER] * length, list(b) or [GAP_CHARACTER] * length)
+            continue
+        aligned = _fast_path(a, b)
+        if aligned is None:
+            pending.append(index)
+        else:
+            results[index] = aligned
+
+    if pending:
+        codes: Dict[str, int] = {}
+        n = max(len(pairs[index][0]) for index in pending)
+        m = max(len(pairs[index][1]) for index in pending)
+        a_codes = np.full((len(pending), n), -1, dtype=np.int64)
+        b_codes = np.full((len(pending), m), -2, dtype=np.int64)
+        for row, index in enumerate(pending):
+            a, b = pairs[index]
+            a_codes[row, : len(a)] = [codes.setdefault(token, len(codes)) for token in a]
+            b_codes[row, : len(b)] = [codes.setdefault(token, len(codes)) for token in b]
+
+        cols = np.arange(m + 1, dtype=np.int64)
+        previous = np.broadcast_to(cols * GAP, (len(pending), m + 1))
+        directions = np.empty((len(pending), n + 1, m + 1), dtype=np.int8)
+        directions[:, 0, :] = LEFT
+
+        for i in range(1, n + 1):
+            scores = np.where(a_codes[:, i - 1, None] == b_codes, MATCH, MISMATCH)
+            up = previous + GAP
+            diagonal = previous[:, :-1] + scores
+            best = up.copy()
+            best[:, 1:] = np.maximum(diagonal, up[:, 1:])
+            row = np.maximum.accumulate(best - GAP * cols, axis=1) + GAP * cols
+
+            direction = np.full(best.shape, UP, dtype=np.int8)
+            direction[:, 1:][diagonal >= up[:, 1:]] = DIAGONAL
+            direction[row > best] = LEFT
+            directions[:, i, :] = direction
+            previous = row
+
+        for row, index in enumerate(pending):
+            a, b = pairs[index]
+            a_aligned: List[str] = []
+            b_aligned: List[str] = []
+            i, j = len(a), len(b)
+            while i > 0 or j > 0:
+                move = LEFT if i == 0 else UP if j == 0 else directions[row, i, j]
+                if move == DIAGONAL:
+                    a_aligned.append(a[i - 1])
+                    b_aligned.append(b[j - 1])
+                    i, j = i - 1, j - 1
+                elif move == UP:
+                    a_aligned.append(a[i - 1])
+                    b_aligned.append(GAP_CHARACTER)
+                    i -= 1
+                else:
+                    a_aligned.append(GAP_CHARACTER)
+                    b_aligned.append(b[j - 1])
+                    j -= 1
+            a_aligned.reverse()
+            b_aligned.reverse()
+            results[index] = (a_aligned, b_aligned)
+
+    return results
+
+
+def align(a: List[str], b: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Align two token sequences with Needleman-Wunsch. Gaps are filled with empty strings.
+
+    Args:
+        a (List[str]): First token sequence
+        b (List[str]): Second token sequence
+
+    Returns:
+        Tuple[List[str], List[str]]: The aligned sequences, of equal length
+    """
+    return align_batch([(a, b)])[0]
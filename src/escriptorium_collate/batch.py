@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+try:
+    from typing import TYPE_CHECKING, Callable, Dict, List
+except ImportError:
+    from typing_extensions import TYPE_CHECKING, Callable, Dict, List
+
+from pydantic import BaseModel
+
+from escriptorium_collate.cache import TokenCache
+from escriptorium_collate.collate import (
+    CollatexArgs,
+    Witness,
+    get_collatex_input,
+    get_collatex_output,
+    make_collatex_input,
+)
+
+if TYPE_CHECKING:
+    from escriptorium_connector import EscriptoriumConnector
+
+
+class BatchJob(BaseModel):
+    """
+    Interface for defining one collation of a batch
+    """
+
+    id: str
+    witnesses: List[Witness]
+    collatex_args: CollatexArgs = CollatexArgs()
+
+
+def load_manifest(path: str) -> List[BatchJob]:
+    """
+    Load the jobs of a batch from a JSON file holding a list of jobs,
+    or from a JSON Lines file (ending in .jsonl) holding one job per line.
+
+    Args:
+        path (str): Path of the manifest
+
+    Returns:
+        List[BatchJob]: The jobs of the batch
+    """
+    with open(path, encoding="UTF-8") as file:
+        if path.endswith(".jsonl"):
+            jobs = [json.loads(line) for line in file if line.strip()]
+        else:
+            jobs = json.load(file)
+    return [BatchJob(**job) for job in jobs]
+
+
+def get_max_workers(memory_per_worker: int = 1024**3) -> int:
+    """
+    Return the number of collations that fit on this machine at once: one per
+    available core, but no more than the available memory allows.
+
+    Args:
+        memory_per_worker (int): Memory needed by one collation in bytes
+
+    Returns:
+        int: Number of worker processes
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    try:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return cpus
+    return max(1, min(cpus, available // memory_per_worker))
+
+
+def _get_witness_key(witness: Witness) -> tuple:
+    return (
+        witness.doc_pk,
+        witness.normalized_transcription_pk,
+        witness.normalized_transcription_name,
+        witness.diplomatic_transcription_pk,
+        witness.diplomatic_transcription_name,
+    )
+
+
+def _run_job(collatex_args: CollatexArgs, input_json: dict, output_path: str):
+    output_json = get_collatex_output(collatex_args=collatex_args, input_json=input_json)
+    with open(f"{output_path}.tmp", "w", encoding="UTF-8") as file:
+        json.dump(output_json, file, ensure_ascii=False)
+    os.replace(f"{output_path}.tmp", output_path)
+
+
+def run_batch(
+    escr: "EscriptoriumConnector",
+    jobs: List[BatchJob],
+    output_dir: str,
+    max_workers: int | None = None,
+    fetch_workers: int = 4,
+    cache: TokenCache | None = None,
+    on_result: Callable[[str, Exception | None], None] | None = None,
+) -> Dict[str, Exception | None]:
+    """
+    Run many independent collations.
+
+    The witnesses of all pending jobs are fetched once, even if several jobs
+    reference the same document and transcription layers. A witness that cannot
+    be fetched (e.g. because of a missing document or transcription layer) only
+    fails the jobs that reference it, with the error raised while fetching it.
+    The collations then run on a process pool, and the output of each job is
+    written to `<output_dir>/<job id>.json` as soon as it finishes. Jobs whose
+    output file already exists are skipped, so an interrupted batch resumes
+    where it stopped, retrying the failed jobs.
+
+    Args:
+        escr (EscriptoriumConnector): An EscriptoriumConnector instance
+        jobs (List[BatchJob]): The jobs of the batch
+        output_dir (str): Directory the outputs are written to, created if missing
+        max_workers (int | None): Maximum number of collations run at once;
+            defaults to get_max_workers()
+        fetch_workers (int): Maximum number of requests to eScriptorium in flight at once
+        cache (TokenCache | None): A TokenCache instance to read and store witness tokens
+        on_result (Callable | None): Called with the job id and the error (or None)
+            of every job as it finishes
+
+    Raises:
+        ValueError: An error is raised if job ids are not unique or contain a path separator.
+
+    Returns:
+        dict: The error raised by each job run, or None if it succeeded, keyed by job id
+    """
+    ids = [job.id for job in jobs]
+    if len(set(ids)) != len(ids):
+        error = "Job ids must be unique"
+        raise ValueError(error)
+    if any(os.sep in job_id or (os.altsep and os.altsep in job_id) for job_id in ids):
+        error = "Job ids must not contain path separators"
+        raise ValueError(error)
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = {job.id: os.path.join(output_dir, f"{job.id}.json") for job in jobs}
+    pending = [job for job in jobs if not os.path.exists(output_paths[job.id])]
+    if not pending:
+        return {}
+
+    witnesses = {}
+    for job in pending:
+        for witness in job.witnesses:
+            witnesses.setdefault(_get_witness_key(witness), witness.copy(update={"siglum": str(len(witnesses))}))
+
+    # Each witness is fetched separately, so that one failing witness does not
+    # abort the others; fetch_workers witnesses are fetched at once, their parts
+    # one after the other, to bound the number of requests in flight.
+    tokens: Dict[str, list] = {}
+    errors: Dict[str, Exception] = {}
+    with ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+        fetches = {
+            executor.submit(
+                get_collatex_input,
+                escr=escr,
+                witnesses=[witness],
+                collatex_args=CollatexArgs(),
+                max_workers=1,
+                cache=cache,
+            ): witness.siglum
+            for witness in witnesses.values()
+        }
+        for future in as_completed(fetches):
+            error = future.exception()
+            if error is not None:
+                errors[fetches[future]] = error
+                continue
+            for witness_json in future.result()["witnesses"]:
+                tokens[witness_json["id"]] = witness_json["tokens"]
+
+    results: Dict[str, Exception | None] = {}
+    with ProcessPoolExecutor(max_workers=max_workers or get_max_workers()) as executor:
+        futures = {}
+        for job in pending:
+            sigla = [witnesses[_get_witness_key(witness)].siglum for witness in job.witnesses]
+            error = next((errors[siglum] for siglum in sigla if siglum in errors), None)
+            if error is not None:
+                results[job.id] = error
+                if on_result is not None:
+                    on_result(job.id, error)
+                continue
+            input_json = make_collatex_input(collatex_args=job.collatex_args, witness_tokens=[])
+            for witness, siglum in zip(job.witnesses, sigla):
+                if tokens.get(siglum):
+                    input_json["witnesses"].append({"id": witness.siglum, "tokens": tokens[siglum]})
+            future = executor.submit(_run_job, job.collatex_args, input_json, output_paths[job.id])
+            futures[future] = job.id
+
+        for future in as_completed(futures):
+            job_id = futures[future]
+            results[job_id] = future.exception()
+            if on_result is not None:
+                on_result(job_id, results[job_id])
+
+    return results
+
+
+def main():
+    from dotenv import load_dotenv
+    from escriptorium_connector import EscriptoriumConnector
+
+    parser = argparse.ArgumentParser(description="Run a batch of independent collations.")
+    parser.add_argument("manifest", help="JSON list of jobs, or JSON Lines file with one job per line")
+    parser.add_argument("output_dir", help="Directory the output of each job is written to")
+    parser.add_argument("--max-workers", type=int, help="Maximum number of collations run at once")
+    parser.add_argument("--memory-per-worker", type=int, default=1024, help="MiB of memory needed per collation")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="Maximum number of requests in flight")
+    parser.add_argument("--cache", help="Path of a TokenCache database")
+    parser.add_argument("--cache-max-age", type=float, help="Seconds after which cached tokens are stale")
+    args = parser.parse_args()
+
+    load_dotenv(override=True)
+    url = str(os.getenv("ESCRIPTORIUM_URL"))
+    api_key = os.getenv("ESCRIPTORIUM_API_KEY")
+    if api_key:
+        escr = EscriptoriumConnector(url, api_key=str(api_key))
+    else:
+        escr = EscriptoriumConnector(
+            url, str(os.getenv("ESCRIPTORIUM_USERNAME")), str(os.getenv("ESCRIPTORIUM_PASSWORD"))
+        )
+
+    def on_result(job_id, error):
+        sys.stdout.write(f"{job_id}: {'failed: ' + str(error) if error else 'done'}\n")
+        sys.stdout.flush()
+
+    jobs = load_manifest(args.manifest)
+    results = run_batch(
+        escr=escr,
+        jobs=jobs,
+        output_dir=args.output_dir,
+        max_workers=args.max_workers or get_max_workers(args.memory_per_worker * 1024**2),
+        fetch_workers=args.fetch_workers,
+        cache=TokenCache(args.cache, max_age=args.cache_max_age) if args.cache else None,
+        on_result=on_result,
+    )
+    failed = [job_id for job_id, error in results.items() if error is not None]
+    sys.stdout.write(f"{len(results) - len(failed)} done, {len(failed)} failed, {len(jobs) - len(results)} skipped\n")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Bumped whenever the format of the stored tokens changes.
+FORMAT_VERSION = 2
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "escriptorium-collate",
+    "tokens.sqlite3",
+)
+
+
+def get_parts_fingerprint(parts: list) -> list | None:
+    """
+    Summarize the revision state of a document's parts.
+
+    The fingerprint contains each part's primary key, order, `updated_at` timestamp
+    and transcription progress, so that any change to these invalidates the witness.
+    The parts returned by the eScriptorium API carry no timestamp, however, and edits
+    to line transcriptions change none of the other fields: if any part has no
+    `updated_at`, None is returned, as the fingerprint could not tell edited parts apart.
+
+    Args:
+        parts (list): Parts as returned by EscriptoriumConnector.get_document_parts
+
+    Returns:
+        list | None: A JSON-serializable fingerprint, or None if a part has no timestamp
+    """
+    if any(getattr(part, "updated_at", None) is None for part in parts):
+        return None
+    return [
+        [
+            part.pk,
+            getattr(part, "order", None),
+            str(part.updated_at),
+            getattr(part, "transcription_progress", None),
+        ]
+        for part in parts
+    ]
+
+
+class TokenCache:
+    """
+    Persistent, content-addressed cache of witness tokens.
+
+    Witness tokens produced by `get_collatex_input` are stored in a SQLite database
+    as compressed JSON, keyed by the document, its transcription layers and the
+    fingerprint of its parts. Storing a new revision of a witness drops the older
+    ones. Once the database grows beyond `max_size` bytes, the least recently
+    used entries are evicted.
+
+    Witnesses whose parts carry no `updated_at` timestamp, as returned by the
+    eScriptorium API, are only cached if `max_age` is set: their entries are then
+    keyed by the parts' primary keys, order and transcription progress, and edits
+    to their line transcriptions are missed until the entries expire.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_size: int = 1024**3,
+        max_age: float | None = None,
+    ):
+        """
+        Args:
+            path (str): Path of the SQLite database, created if missing
+            max_size (int): Maximum total size of the (compressed) entries in bytes
+            max_age (float | None): If set, entries older than this many seconds are
+                treated as stale. Required to cache witnesses whose parts carry no
+                timestamp, which is the case on eScriptorium instances that do not
+                expose part timestamps.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tokens (
+                key TEXT PRIMARY KEY,
+                doc_pk INTEGER NOT NULL,
+                layers TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tokens_witness ON tokens (doc_pk, layers)")
+        self._db.commit()
+
+    def get_key(
+        self,
+        doc_pk: int,
+        normalized_transcription_pk: int | None,
+        diplomatic_transcription_pk: int | None,
+        parts: list,
+    ) -> str | None:
+        """
+        Return the cache key of a witness, or None if the witness cannot be cached:
+        if its parts carry no timestamp and max_age is not set.
+
+        Args:
+            doc_pk (int): Primary key of an eScriptorium document
+            normalized_transcription_pk (int | None): Primary key of the normalized transcription layer
+            diplomatic_transcription_pk (int | None): Primary key of the diplomatic transcription layer
+            parts (list): Parts as returned by EscriptoriumConnector.get_document_parts
+
+        Returns:
+            str | None: A SHA-256 hex digest
+        """
+        fingerprint = get_parts_fingerprint(parts)
+        if fingerprint is None:
+            if self.max_age is None:
+                return None
+            fingerprint = [
+                [part.pk, getattr(part, "order", None), getattr(part, "transcription_progress", None)] for part in parts
+            ]
+        payload = [
+            FORMAT_VERSION,
+            doc_pk,
+            normalized_transcription_pk,
+            diplomatic_transcription_pk,
+            fingerprint,
+        ]
+        return hashlib.sha256(json.dumps(payload).encode("UTF-8")).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """
+        Return the tokens stored under a given key, or None on a cache miss.
+        Tokens are stored in the columnar form of WitnessTokens.to_columns.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT data, created FROM tokens WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            data, created = row
+            now = time.time()
+            if self.max_age is not None and now - created > self.max_age:
+                self._db.execute("DELETE FROM tokens WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE tokens SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return json.loads(zlib.decompress(data))
+
+    def put(
+        self,
+        key: str,
+        doc_pk: int,
+        normalized_transcription_pk: int | None,
+        diplomatic_transcription_pk: int | None,
+        tokens: dict,
+    ):
+        """
+        Store the tokens of a witness, replacing any other revision of the same
+        document and transcription layers, then evict entries beyond max_size.
+        """
+        data = zlib.compress(json.dumps(tokens, ensure_ascii=False).encode("UTF-8"))
+        layers = json.dumps([normalized_transcription_pk, diplomatic_transcription_pk])
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM tokens WHERE doc_pk = ? AND layers = ?", (doc_pk, layers))
+            self._db.execute(
+                "INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, doc_pk, layers, data, len(data), now, now),
+            )
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, doc_pk: int | None = None):
+        """
+        Drop the entries of a given document, or every entry if doc_pk is omitted.
+        """
+        with self._lock:
+            if doc_pk is None:
+                self._db.execute("DELETE FROM tokens")
+            else:
+                self._db.execute("DELETE FROM tokens WHERE doc_pk = ?", (doc_pk,))
+            self._db.commit()
+
+    def size(self) -> int:
+        """
+        Return the total size of the stored entries in bytes.
+        """
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM tokens").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM tokens").fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._db.execute("SELECT key, size FROM tokens ORDER BY accessed ASC").fetchall()
+        for key, size in rows[:-1]:
+            self._db.execute("DELETE FROM tokens WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_size:
+                break
@@ -1,24 +1,32 @@
+import contextlib
+import io
 import json
 import os
 import subprocess
 import tempfile
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
 
 try:
-    from importlib.resources import files
+    from typing import TYPE_CHECKING, Iterator, List, Literal, Tuple
 except ImportError:
-    from importlib_resources import files
+    from typing_extensions import TYPE_CHECKING, Iterator, List, Literal, Tuple
 
-try:
-    from typing import List, Literal
-except ImportError:
-    from typing_extensions import List, Literal
-
-from escriptorium_connector import EscriptoriumConnector
-from minineedle import core, needle
-from nltk.tokenize import WhitespaceTokenizer
 from pydantic import BaseModel
 
-from escriptorium_collate.transcription_layers import get_transcription_pk_by_name
+from escriptorium_collate import segment
+from escriptorium_collate.fetch import get_part_line_transcriptions, with_retry
+from escriptorium_collate.server import CollatexServer, get_jar_path
+from escriptorium_collate.stats import CollationStats, stage
+from escriptorium_collate.stream import AlignmentColumn, CollatexOutputReader, restore_empty_token
+from escriptorium_collate.tokens import WitnessTokens, tokenize
+from escriptorium_collate.transcription_layers import get_layer_registry
+
+if TYPE_CHECKING:
+    from escriptorium_connector import EscriptoriumConnector
+
+    from escriptorium_collate.cache import TokenCache
 
 
 class Witness(BaseModel):
@@ -38,6 +46,10 @@ class Witness(BaseModel):
 class CollatexArgs(BaseModel):
     """
     Interface for passing arguments to the CollateX command line interface
+
+    If engine is "python", the collation runs in-process (see escriptorium_collate.engine)
+    instead of in the CollateX Jar; only the algorithm "needleman-wunsch" is available then,
+    and other algorithms raise a ValueError.
     """
 
     algorithm: Literal["needleman-wunsch", "medite", "dekker"] = "needleman-wunsch"
@@ -52,12 +64,140 @@ class CollatexArgs(BaseModel):
     output: str | None
     tokenized: bool = False
     token_comparator: Literal["equality", "levenshtein"] = "equality"
+    engine: Literal["collatex", "python"] = "collatex"
+
+
+def _get_transcription_layer_pks(
+    escr: "EscriptoriumConnector",
+    witness: Witness,
+):
+    """
+    Resolve the normalized and diplomatic transcription layers of a witness.
+
+    Args:
+        escr (EscriptoriumConnector): An EscriptoriumConnector instance
+        witness (Witness): A Witness instance
+
+    Returns:
+        tuple: Primary keys of the normalized and diplomatic transcription layers
+    """
+    doc_pk = witness.doc_pk
+    registry = get_layer_registry(escr)
+
+    normalized_transcription_layer_pk = None
+    diplomatic_transcription_layer_pk = None
+
+    if witness.normalized_transcription_pk:
+        normalized_transcription_layer_pk = registry.get_layer(
+            doc_pk=doc_pk,
+            transcription_pk=witness.normalized_transcription_pk,
+        ).pk
+    elif witness.normalized_transcription_name:
+        normalized_transcription_layer_pk = registry.get_pk_by_name(
+            doc_pk=doc_pk,
+            transcription_name=witness.normalized_transcription_name,
+        )
+
+    if witness.diplomatic_transcription_pk:
+        diplomatic_transcription_layer_pk = registry.get_layer(
+            doc_pk=doc_pk,
+            transcription_pk=witness.diplomatic_transcription_pk,
+        ).pk
+    elif witness.diplomatic_transcription_name:
+        diplomatic_transcription_layer_pk = registry.get_pk_by_name(
+            doc_pk=doc_pk,
+            transcription_name=witness.diplomatic_transcription_name,
+        )
+
+    return normalized_transcription_layer_pk, diplomatic_transcription_layer_pk
+
+
+def get_part_tokens(
+    escr: "EscriptoriumConnector",
+    doc_pk: int,
+    part_pk: int,
+    normalized_transcription_layer_pk: int | None,
+    diplomatic_transcription_layer_pk: int | None,
+    stats: CollationStats | None = None,
+) -> WitnessTokens:
+    """
+    Return the CollateX tokens of a single document part, in line order.
+
+    Args:
+        escr (EscriptoriumConnector): An EscriptoriumConnector instance
+        doc_pk (int): Primary key of an eScriptorium document
+        part_pk (int): Primary key of a part of that document
+        normalized_transcription_layer_pk (int | None): Primary key of the normalized transcription layer
+        diplomatic_transcription_layer_pk (int | None): Primary key of the diplomatic transcription layer
+        stats (CollationStats | None): If given, tokenization and alignment time are recorded in it
+
+    Returns:
+        WitnessTokens: CollateX tokens
+    """
+    tokens = WitnessTokens(
+        doc_pk=doc_pk,
+        normalized_transcription_pk=normalized_transcription_layer_pk,
+        diplomatic_transcription_pk=diplomatic_transcription_layer_pk,
+    )
+    if not normalized_transcription_layer_pk and not diplomatic_transcription_layer_pk:
+        return tokens
+
+    lines = with_retry(escr.get_document_part_lines, doc_pk=doc_pk, part_pk=part_pk).results
+    line_transcriptions = get_part_line_transcriptions(escr=escr, doc_pk=doc_pk, part_pk=part_pk)
+
+    if normalized_transcription_layer_pk == diplomatic_transcription_layer_pk:
+        with stage(stats, "tokenize"):
+            for line in lines:
+                normalized_line = line_transcriptions.get(line.pk, {}).get(normalized_transcription_layer_pk)
+                if normalized_line:
+                    for value in tokenize(normalized_line.content):
+                        tokens.append(value, None, normalized_line.line, normalized_line.pk, normalized_line.pk)
+    else:
+        tokenized_lines = []
+        with stage(stats, "tokenize"):
+            for line in lines:
+                normalized_line = line_transcriptions.get(line.pk, {}).get(normalized_transcription_layer_pk)
+                diplomatic_line = line_transcriptions.get(line.pk, {}).get(diplomatic_transcription_layer_pk)
+                normalized_seq = tokenize(normalized_line.content) if normalized_line else []
+                diplomatic_seq = tokenize(diplomatic_line.content) if diplomatic_line else []
+                tokenized_lines.append([normalized_line, diplomatic_line, normalized_seq, diplomatic_seq])
+
+        # Align every line whose normalized and diplomatic token counts differ in one batch.
+        # The aligner (and NumPy) are only imported once a line needs aligning.
+        with stage(stats, "align"):
+            from escriptorium_collate import aligner
+
+            misaligned = [
+                entry for entry in tokenized_lines if entry[0] and entry[1] and len(entry[2]) != len(entry[3])
+            ]
+            for entry, (normalized_seq, diplomatic_seq) in zip(
+                misaligned, aligner.align_batch([(entry[2], entry[3]) for entry in misaligned])
+            ):
+                entry[2], entry[3] = normalized_seq, diplomatic_seq
+
+        for normalized_line, diplomatic_line, normalized_seq, diplomatic_seq in tokenized_lines:
+            if normalized_line and diplomatic_line:
+                for index, value in enumerate(normalized_seq):
+                    tokens.append(
+                        diplomatic_seq[index], value, normalized_line.line, normalized_line.pk, diplomatic_line.pk
+                    )
+            elif normalized_line:
+                for value in normalized_seq:
+                    tokens.append(value, None, normalized_line.line, normalized_line.pk, None)
+            elif diplomatic_line:
+                for value in diplomatic_seq:
+                    tokens.append(value, None, diplomatic_line.line, None, diplomatic_line.pk)
+
+    return tokens
 
 
 def get_collatex_input(
-    escr: EscriptoriumConnector,
+    escr: "EscriptoriumConnector",
     witnesses: List[Witness],
     collatex_args: CollatexArgs,
+    max_workers: int = 1,
+    cache: "TokenCache | None" = None,
+    stats: CollationStats | None = None,
 ):
     """
     Given two or more Witness instances and a set of CollateX arguments,
@@ -67,174 +207,109 @@ def get_collatex_input(
         escr (EscriptoriumConnector): An EscriptoriumConnector instance
         witnesses (List[Witness]): A list of Witness instances to be collated
         collatex_args (CollatexArgs): An instance of CollatexArgs
+        max_workers (int): Maximum number of requests to eScriptorium in flight
+            at once; witnesses and parts are fetched concurrently if greater than 1
+        cache (TokenCache | None): If given, the tokens of witnesses whose parts are
+            unchanged since the last run are read from this cache instead of eScriptorium
+            (see TokenCache for witnesses whose parts carry no timestamp)
+        stats (CollationStats | None): If given, stage durations, requests and
+            token counts are recorded in it
 
     Returns:
         dict: CollateX input JSON
     """
-    input_json = {
-        "witnesses": [],
-        "algorithm": collatex_args.algorithm,
-        "tokenComparator": {
-            "type": collatex_args.token_comparator,
-            "distance": collatex_args.distance,
-        },
-    }
+    if stats is not None:
+        escr = stats.instrument(escr)
+
+    witness_tokens = []
+
+    with stage(stats, "resolve_layers"):
+        get_layer_registry(escr).load([witness.doc_pk for witness in witnesses], max_workers=max_workers)
+        layer_pks = [_get_transcription_layer_pks(escr, witness) for witness in witnesses]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with stage(stats, "get_parts"):
+            parts = list(
+                executor.map(
+                    lambda witness: with_retry(escr.get_document_parts, doc_pk=witness.doc_pk).results,
+                    witnesses,
+                )
+            )
+        cache_keys = [None] * len(witnesses)
+        cached_tokens = [None] * len(witnesses)
+        if cache is not None:
+            with stage(stats, "cache"):
+                for index, witness in enumerate(witnesses):
+                    cache_keys[index] = cache.get_key(witness.doc_pk, *layer_pks[index], parts[index])
+                    if cache_keys[index] is not None:
+                        cached_tokens[index] = cache.get(cache_keys[index])
+
+        jobs = [
+            (witness.doc_pk, part.pk, *layer_pks[index])
+            for index, witness in enumerate(witnesses)
+            if cached_tokens[index] is None
+            for part in parts[index]
+        ]
+        part_tokens = iter(executor.map(lambda job: get_part_tokens(escr, *job, stats=stats), jobs))
+
+        for index, witness in enumerate(witnesses):
+            if cached_tokens[index] is not None:
+                tokens = WitnessTokens.from_columns(cached_tokens[index])
+            else:
+                tokens = WitnessTokens(witness.doc_pk, *layer_pks[index])
+                with stage(stats, "part_tokens"):
+                    for _ in parts[index]:
+                        tokens.extend(next(part_tokens))
+                if cache_keys[index] is not None:
+                    with stage(stats, "cache"):
+                        cache.put(cache_keys[index], witness.doc_pk, *layer_pks[index], tokens.to_columns())
 
-    for witness in witnesses:
-        doc_pk = witness.doc_pk
+            witness_tokens.append((witness.siglum, tokens))
+            if stats is not None:
+                stats.tokens[witness.siglum] = len(tokens)
 
-        normalized_transcription_layer_pk = None
-        diplomatic_transcription_layer_pk = None
+    with stage(stats, "make_input"):
+        return make_collatex_input(collatex_args=collatex_args, witness_tokens=witness_tokens)
 
-        if witness.diplomatic_transcription_pk:
-            normalized_transcription_layer_pk = escr.get_document_transcription(
-                doc_pk=doc_pk, transcription_pk=witness.diplomatic_transcription_pk
-            )
-        elif witness.normalized_transcription_name:
-            normalized_transcription_layer_pk = get_transcription_pk_by_name(
-                escr=escr,
-                doc_pk=doc_pk,
-                transcription_name=witness.normalized_transcription_name,
-            )
 
-        if witness.diplomatic_transcription_pk:
-            diplomatic_transcription_layer_pk = escr.get_document_transcription(
-                doc_pk=doc_pk, transcription_pk=witness.diplomatic_transcription_pk
-            )
-        elif witness.diplomatic_transcription_name:
-            diplomatic_transcription_layer_pk = get_transcription_pk_by_name(
-                escr=escr,
-                doc_pk=doc_pk,
-                transcription_name=witness.diplomatic_transcription_name,
-            )
-
-        tokens = []
-        parts = escr.get_document_parts(doc_pk=doc_pk).results
-        for part in parts:
-            if not normalized_transcription_layer_pk and not diplomatic_transcription_layer_pk:
-                pass
-            elif normalized_transcription_layer_pk == diplomatic_transcription_layer_pk:
-                lines = escr.get_document_part_lines(doc_pk=doc_pk, part_pk=part.pk).results
-                for line in lines:
-                    normalized_line = escr.get_document_part_line_transcription_by_transcription(
-                        doc_pk=doc_pk,
-                        part_pk=part.pk,
-                        line_pk=line.pk,
-                        transcription_pk=normalized_transcription_layer_pk,
-                    )
-                    if normalized_line:
-                        normalized_seq = WhitespaceTokenizer().tokenize(normalized_line.content)
-                        for index, value in enumerate(normalized_seq):
-                            token = {
-                                "t": value,
-                                "doc_pk": doc_pk,
-                                "line_pk": normalized_line.line,
-                                "normalized_transcription_pk": normalized_line.transcription,
-                                "normalized_line_transcription_pk": normalized_line.pk,
-                                "diplomatic_transcription_pk": normalized_line.transcription,
-                                "diplomatic_line_transcription_pk": normalized_line.pk,
-                            }
-                            tokens.append(token)
-            else:
-                lines = escr.get_document_part_lines(doc_pk=doc_pk, part_pk=part.pk).results
-                for line in lines:
-                    normalized_line = escr.get_document_part_line_transcription_by_transcription(
-                        doc_pk=doc_pk,
-                        part_pk=part.pk,
-                        line_pk=line.pk,
-                        transcription_pk=normalized_transcription_layer_pk,
-                    )
-                    diplomatic_line = escr.get_document_part_line_transcription_by_transcription(
-                        doc_pk=doc_pk,
-                        part_pk=part.pk,
-                        line_pk=line.pk,
-                        transcription_pk=diplomatic_transcription_layer_pk,
-                    )
-                    if normalized_line and diplomatic_line:
-                        normalized_seq = WhitespaceTokenizer().tokenize(normalized_line.content)
-                        diplomatic_seq = WhitespaceTokenizer().tokenize(diplomatic_line.content)
-                        if len(normalized_seq) != len(diplomatic_seq):
-                            alignment: needle.NeedlemanWunsch[str] = needle.NeedlemanWunsch(
-                                normalized_seq, diplomatic_seq
-                            )
-                            alignment.gap_character = ""
-                            alignment.align()
-                            (normalized_algn, diplomatic_algn) = alignment.get_aligned_sequences(
-                                core.AlignmentFormat.list
-                            )
-                            normalized_seq = [str(e) for e in normalized_algn]
-                            diplomatic_seq = [str(e) for e in diplomatic_algn]
-                        for index, value in enumerate(normalized_seq):
-                            token = {
-                                "t": diplomatic_seq[index],
-                                "n": value,
-                                "doc_pk": doc_pk,
-                                "line_pk": normalized_line.line,
-                                "normalized_transcription_pk": normalized_line.transcription,
-                                "normalized_line_transcription_pk": normalized_line.pk,
-                                "diplomatic_transcription_pk": diplomatic_line.transcription,
-                                "diplomatic_line_transcription_pk": diplomatic_line.pk,
-                            }
-                            tokens.append(token)
-                    elif normalized_line:
-                        normalized_seq = WhitespaceTokenizer().tokenize(normalized_line.content)
-                        for index, value in enumerate(normalized_seq):
-                            token = {
-                                "t": value,
-                                "doc_pk": doc_pk,
-                                "line_pk": normalized_line.line,
-                                "normalized_transcription_pk": normalized_line.transcription,
-                                "normalized_line_transcription_pk": normalized_line.pk,
-                                "diplomatic_transcription_pk": None,
-                                "diplomatic_line_transcription_pk": None,
-                            }
-                            tokens.append(token)
-                    elif diplomatic_line:
-                        diplomatic_seq = WhitespaceTokenizer().tokenize(diplomatic_line.content)
-                        for index, value in enumerate(diplomatic_seq):
-                            token = {
-                                "t": value,
-                                "doc_pk": doc_pk,
-                                "line_pk": diplomatic_line.line,
-                                "normalized_transcription_pk": None,
-                                "normalized_line_transcription_pk": None,
-                                "diplomatic_transcription_pk": diplomatic_line.transcription,
-                                "diplomatic_line_transcription_pk": diplomatic_line.pk,
-                            }
-                            tokens.append(token)
-
-        if len(tokens) > 0:
-            input_json["witnesses"].append({"id": witness.siglum, "tokens": tokens})
-
-        for witness in input_json["witnesses"]:
-            for token in witness["tokens"]:
-                for key, value in token.items():
-                    if key in ("n", "t") and value == "":
-                        token[key] = " "
-
-    return input_json
-
-
-def get_collatex_output(collatex_args: CollatexArgs):
+def make_collatex_input(collatex_args: CollatexArgs, witness_tokens: List[tuple]):
     """
-    Pass a given instance of CollatexArgs to the CollateX JAR.
+    Assemble CollateX input JSON from the tokens of each witness.
+    Witnesses without tokens are left out.
 
     Args:
         collatex_args (CollatexArgs): An instance of CollatexArgs
-
-    Raises:
-        RuntimeError: An error is raised if CollateX fails.
+        witness_tokens (List[tuple]): Pairs of (siglum, WitnessTokens), in witness order
 
     Returns:
-        dict: CollateX output JSON
+        dict: CollateX input JSON
     """
+    return {
+        "witnesses": [{"id": siglum, "tokens": tokens.to_json()} for siglum, tokens in witness_tokens if len(tokens)],
+        "algorithm": collatex_args.algorithm,
+        "tokenComparator": {
+            "type": collatex_args.token_comparator,
+            "distance": collatex_args.distance,
+        },
+    }
 
-    jar_path = str(files("escriptorium_collate") / "__assets__" / "collatex-tools-1.7.1.jar")
 
+def _restore_empty_tokens(column: list):
+    """
+    Turn the placeholder " " tokens of a column of the CollateX alignment table
+    back into empty strings.
+    """
+    for cell in column:
+        for token in cell:
+            restore_empty_token(token)
+    return column
+
+
+def _get_collatex_command(collatex_args: CollatexArgs, input_path: str):
     args = [
         "java",
         "-jar",
-        jar_path,
+        get_jar_path(),
         "-a",
         collatex_args.algorithm,
         "-f",
@@ -254,40 +329,407 @@ def get_collatex_output(collatex_args: CollatexArgs):
         args.extend(["-oe", collatex_args.output_encoding])
 
     if collatex_args.max_collation_size:
-        args.extend(["-mcs", collatex_args.max_collation_size])
+        args.extend(["-mcs", str(collatex_args.max_collation_size)])
 
     if collatex_args.max_parallel_collations:
-        args.extend(["-mpc", collatex_args.max_parallel_collations])
+        args.extend(["-mpc", str(collatex_args.max_parallel_collations)])
+
+    args.append(input_path)
+
+    return args
 
-    args.append(collatex_args.input)
 
-    with subprocess.Popen(
-        args,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    ) as cmd:
-        out, err = cmd.communicate()
+def _write_collatex_input(pipe, input_json: dict, encoding: str, stats: CollationStats | None = None):
+    try:
+        with stage(stats, "write_input"), io.TextIOWrapper(pipe, encoding=encoding) as stdin:
+            json.dump(input_json, stdin, ensure_ascii=False)
+    except (BrokenPipeError, ValueError):
+        # CollateX exited early; its return code and stderr are reported instead.
+        pass
 
-        if cmd.returncode != 0:
-            error = f"CollateX failed: {cmd.returncode} {out} {err}"
+
+def iter_collatex_output(
+    collatex_args: CollatexArgs,
+    input_json: dict | None = None,
+    stats: CollationStats | None = None,
+) -> Iterator[list]:
+    """
+    Run CollateX and yield the columns of its alignment table as they are parsed.
+
+    If input_json is given, it is streamed to CollateX over a pipe (via /dev/stdin,
+    falling back to a temporary file on platforms without it); otherwise
+    CollatexArgs.input is read. The output is parsed incrementally from stdout.
+    With the "python" engine, the collation runs in-process instead.
+
+    Each column holds one cell per witness, in the order of the `witnesses` of
+    the output, which CollateX sorts by siglum (see get_collatex_output).
+
+    Args:
+        collatex_args (CollatexArgs): An instance of CollatexArgs with format "json"
+        input_json (dict | None): CollateX input JSON
+        stats (CollationStats | None): If given, the time spent writing the input
+            and running CollateX, the output size and the peak RSS of CollateX are recorded in it
+
+    Raises:
+        RuntimeError: An error is raised if CollateX fails.
+
+    Yields:
+        list: One column of the CollateX alignment table, one cell per witness
+    """
+    yield from _iter_collatex_output(collatex_args=collatex_args, input_json=input_json, stats=stats, header={})
+
+
+def _iter_collatex_output(
+    collatex_args: CollatexArgs,
+    input_json: dict | None,
+    stats: CollationStats | None,
+    header: dict,
+) -> Iterator[list]:
+    """
+    Yield the columns of the alignment table like iter_collatex_output, and store
+    the `witnesses` of the output in header before the first column is yielded.
+    """
+    input_encoding = collatex_args.input_encoding or "UTF-8"
+    output_encoding = collatex_args.output_encoding or "UTF-8"
+
+    if collatex_args.engine == "python":
+        if input_json is None:
+            with open(collatex_args.input, encoding=input_encoding) as file:
+                input_json = json.load(file)
+        with stage(stats, "python_engine"):
+            from escriptorium_collate import engine
+
+            output = engine.collate_input(
+                input_json={**input_json, "algorithm": collatex_args.algorithm},
+                tokenized=collatex_args.tokenized,
+            )
+        header["witnesses"] = output["witnesses"]
+        for column in output["table"]:
+            yield _restore_empty_tokens(column)
+        return
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(stage(stats, "collatex"))
+        if input_json is None:
+            input_path = collatex_args.input
+        elif os.path.exists("/dev/stdin"):
+            input_path = "/dev/stdin"
+        else:
+            start = time.perf_counter()
+            file = stack.enter_context(tempfile.NamedTemporaryFile(mode="w", encoding=input_encoding, delete=False))
+            stack.callback(os.remove, file.name)
+            json.dump(input_json, file, ensure_ascii=False)
+            file.close()
+            input_path = file.name
+            input_json = None
+            if stats is not None:
+                stats.add_stage("write_input", time.perf_counter() - start)
+
+        stderr = stack.enter_context(tempfile.TemporaryFile())
+        cmd = stack.enter_context(
+            subprocess.Popen(
+                _get_collatex_command(collatex_args, input_path),
+                stdin=subprocess.PIPE if input_json is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+            )
+        )
+
+        writer = None
+        if input_json is not None:
+            writer = threading.Thread(target=_write_collatex_input, args=(cmd.stdin, input_json, input_encoding, stats))
+            writer.start()
+
+        completed = False
+        reader = CollatexOutputReader(
+            io.TextIOWrapper(cmd.stdout, encoding=output_encoding),
+            object_hook=restore_empty_token,
+        )
+        try:
+            for column in reader:
+                # CollateX writes its witnesses before the table.
+                header.setdefault("witnesses", reader.witnesses)
+                yield column
+            header.setdefault("witnesses", reader.witnesses or [])
+            completed = True
+        except ValueError as err:
+            if cmd.wait() == 0:
+                raise
+            stderr.seek(0)
+            error = f"CollateX failed: {cmd.returncode} {stderr.read()}"
+            raise RuntimeError(error) from err
+        finally:
+            if not completed and cmd.poll() is None:
+                cmd.kill()
+            if writer is not None:
+                writer.join()
+            if stats is not None:
+                stats.output_chars = (stats.output_chars or 0) + reader.chars_read
+
+        if cmd.wait() != 0:
+            stderr.seek(0)
+            error = f"CollateX failed: {cmd.returncode} {stderr.read()}"
             raise RuntimeError(error)
+        if stats is not None:
+            stats.record_subprocess()
 
-    output = json.loads(out)
 
-    for row in output["table"]:
-        for cell in row:
-            for token in cell:
-                for key, value in token.items():
-                    if key in ("n", "t") and value == " ":
-                        token[key] = ""
+def get_collatex_output(
+    collatex_args: CollatexArgs,
+    server: CollatexServer | None = None,
+    input_json: dict | None = None,
+    stats: CollationStats | None = None,
+):
+    """
+    Pass a given instance of CollatexArgs to the CollateX JAR.
+
+    Args:
+        collatex_args (CollatexArgs): An instance of CollatexArgs
+        server (CollatexServer | None): If given, the input is posted to this
+            long-lived CollateX server instead of starting a new JVM
+        input_json (dict | None): CollateX input JSON; if given, it is passed to
+            CollateX directly instead of being read from CollatexArgs.input
+        stats (CollationStats | None): If given, stage durations and the output size are recorded in it
+
+    Raises:
+        RuntimeError: An error is raised if CollateX fails.
+
+    Returns:
+        dict: CollateX output JSON: its `witnesses` are the sigla sorted as CollateX
+            sorts them, and its `table` a list of columns, each holding one cell
+            (a list of tokens) per witness in that order
+    """
+    if server is not None and collatex_args.engine == "collatex":
+        if input_json is None:
+            with stage(stats, "read_input"):
+                with open(collatex_args.input, encoding=collatex_args.input_encoding or "UTF-8") as file:
+                    input_json = json.load(file)
+        with stage(stats, "collatex_server"):
+            output = server.collate(
+                input_json=input_json,
+                output_format=collatex_args.format,
+                tokenized=collatex_args.tokenized,
+                object_hook=restore_empty_token,
+            )
+    else:
+        header: dict = {}
+        table = list(
+            _iter_collatex_output(collatex_args=collatex_args, input_json=input_json, stats=stats, header=header)
+        )
+        output = {"witnesses": header["witnesses"], "table": table}
+
+    if stats is not None:
+        stats.output_columns = len(output["table"])
 
     return output
 
 
+def iter_alignment_columns(
+    collatex_args: CollatexArgs,
+    input_json: dict | None = None,
+    server: CollatexServer | None = None,
+    stats: CollationStats | None = None,
+) -> Iterator[AlignmentColumn]:
+    """
+    Collate and yield the columns of the alignment table lazily, as AlignmentColumn
+    instances labelling the cells of each column with the sigla of their witnesses.
+
+    Args:
+        collatex_args (CollatexArgs): An instance of CollatexArgs with format "json"
+        input_json (dict | None): CollateX input JSON; if omitted, CollatexArgs.input is read
+        server (CollatexServer | None): If given, the input is posted to this
+            long-lived CollateX server instead of starting a new JVM
+        stats (CollationStats | None): If given, stage durations and the output size are recorded in it
+
+    Raises:
+        RuntimeError: An error is raised if CollateX fails.
+
+    Yields:
+        AlignmentColumn: One column of the alignment table, with one cell per witness
+    """
+    header: dict = {}
+    if server is not None and collatex_args.engine == "collatex":
+        output = get_collatex_output(collatex_args=collatex_args, server=server, input_json=input_json, stats=stats)
+        header["witnesses"] = output["witnesses"]
+        columns = output["table"]
+    else:
+        columns = _iter_collatex_output(collatex_args=collatex_args, input_json=input_json, stats=stats, header=header)
+
+    for index, column in enumerate(columns):
+        yield AlignmentColumn(index, dict(zip(header["witnesses"], column)))
+
+
+def write_collatex_output_jsonl(
+    collatex_args: CollatexArgs,
+    input_json: dict | None = None,
+    server: CollatexServer | None = None,
+    stats: CollationStats | None = None,
+) -> int:
+    """
+    Collate and write the alignment table to CollatexArgs.output in JSON Lines,
+    one {"index": ..., "cells": {siglum: [...]}} object per column, as the columns
+    are parsed. The full output is never held in memory.
+
+    Args:
+        collatex_args (CollatexArgs): An instance of CollatexArgs with format "json" and an output path
+        input_json (dict | None): CollateX input JSON; if omitted, CollatexArgs.input is read
+        server (CollatexServer | None): If given, the input is posted to this
+            long-lived CollateX server instead of starting a new JVM
+        stats (CollationStats | None): If given, stage durations and the output size are recorded in it
+
+    Raises:
+        RuntimeError: An error is raised if CollateX fails.
+
+    Returns:
+        int: Number of columns written
+    """
+    count = 0
+    with open(f"{collatex_args.output}.tmp", "w", encoding=collatex_args.output_encoding or "UTF-8") as file:
+        for column in iter_alignment_columns(
+            collatex_args=collatex_args, input_json=input_json, server=server, stats=stats
+        ):
+            json.dump(column._asdict(), file, ensure_ascii=False)
+            file.write("\n")
+            count += 1
+    os.replace(f"{collatex_args.output}.tmp", collatex_args.output)
+    return count
+
+
+def _get_executor(
+    collatex_args: CollatexArgs,
+    server: CollatexServer | None,
+    max_workers: int | None,
+) -> Tuple[Executor, CollatexServer | None]:
+    """
+    Return an executor for running get_collatex_output on several inputs at once,
+    and the server to pass to it: threads posting to the server if one is used
+    with the CollateX engine, and worker processes without a server otherwise.
+    """
+    if server is not None and collatex_args.engine == "collatex":
+        return ThreadPoolExecutor(max_workers=max_workers), server
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(max_workers=max_workers), None
+
+
+def get_segmented_collatex_output(
+    collatex_args: CollatexArgs,
+    input_json: dict,
+    segment_size: int,
+    max_workers: int | None = None,
+    server: CollatexServer | None = None,
+    stats: CollationStats | None = None,
+):
+    """
+    Split the input at stable anchor tokens (see escriptorium_collate.segment),
+    collate the segments independently and in parallel, and stitch the resulting
+    tables back into one alignment table.
+
+    Args:
+        collatex_args (CollatexArgs): An instance of CollatexArgs
+        input_json (dict): CollateX input JSON
+        segment_size (int): Target number of tokens per segment
+        max_workers (int | None): Maximum number of segments collated at once;
+            defaults to the number of processors
+        server (CollatexServer | None): If given, segments are posted to this
+            CollateX server from threads instead of being collated in worker processes
+        stats (CollationStats | None): If given, stage durations and the number of
+            output columns are recorded in it
+
+    Raises:
+        RuntimeError: An error is raised if CollateX fails.
+
+    Returns:
+        dict: CollateX output JSON
+    """
+    with stage(stats, "split_input"):
+        segments = segment.split_input(input_json=input_json, segment_size=segment_size)
+    sigla = sorted(witness["id"] for witness in input_json["witnesses"])
+
+    if len(segments) == 1:
+        return get_collatex_output(collatex_args=collatex_args, server=server, input_json=input_json, stats=stats)
+
+    executor, server = _get_executor(collatex_args=collatex_args, server=server, max_workers=max_workers)
+
+    with stage(stats, "collate_segments"), executor:
+        outputs = list(
+            executor.map(
+                get_collatex_output,
+                [collatex_args] * len(segments),
+                [server] * len(segments),
+                segments,
+            )
+        )
+
+    with stage(stats, "stitch_outputs"):
+        output = segment.stitch_outputs(sigla=sigla, outputs=outputs)
+    if stats is not None:
+        stats.output_columns = len(output["table"])
+    return output
+
+
+def get_clustered_collatex_output(
+    collatex_args: CollatexArgs,
+    input_json: dict,
+    threshold: float,
+    max_workers: int | None = None,
+    server: CollatexServer | None = None,
+) -> List[dict]:
+    """
+    Split the witnesses into clusters of similar witnesses (see
+    escriptorium_collate.order), and collate each cluster separately and in
+    parallel, its witnesses ordered along the guide tree.
+
+    Args:
+        collatex_args (CollatexArgs): An instance of CollatexArgs
+        input_json (dict): CollateX input JSON
+        threshold (float): Minimum average estimated Jaccard similarity of the
+            witness token shingles within a cluster, between 0 and 1
+        max_workers (int | None): Maximum number of clusters collated at once;
+            defaults to the number of processors
+        server (CollatexServer | None): If given, clusters are posted to this
+            CollateX server from threads instead of being collated in worker processes
+
+    Raises:
+        RuntimeError: An error is raised if CollateX fails.
+
+    Returns:
+        List[dict]: CollateX output of each cluster, largest cluster first
+    """
+    from escriptorium_collate import order
+
+    clusters = order.cluster_witnesses(input_json=input_json, threshold=threshold)
+
+    if len(clusters) == 1:
+        return [get_collatex_output(collatex_args=collatex_args, server=server, input_json=clusters[0])]
+
+    executor, server = _get_executor(collatex_args=collatex_args, server=server, max_workers=max_workers)
+
+    with executor:
+        return list(
+            executor.map(
+                get_collatex_output,
+                [collatex_args] * len(clusters),
+                [server] * len(clusters),
+                clusters,
+            )
+        )
+
+
 def collate(
-    escr: EscriptoriumConnector,
+    escr: "EscriptoriumConnector",
     witnesses: List[Witness],
     collatex_args: CollatexArgs,
+    max_workers: int = 1,
+    cache: "TokenCache | None" = None,
+    server: CollatexServer | None = None,
+    segment_size: int | None = None,
+    stats: CollationStats | None = None,
+    *,
+    jsonl: bool = False,
+    order_witnesses: bool = False,
+    segment_workers: int | None = None,
 ):
     """
     Run the complete collation pipeline via one function call.
@@ -296,30 +738,88 @@ def collate(
         escr (EscriptoriumConnector): An EscriptoriumConnector instance
         witnesses (List[Witness]): A list of Witness instances
         collatex_args (CollatexArgs): An instance of CollatexArgs
+        max_workers (int): Maximum number of requests to eScriptorium in flight at once
+        cache (TokenCache | None): A TokenCache instance to read and store witness tokens
+        server (CollatexServer | None): A CollatexServer instance to collate with,
+            instead of starting a new JVM
+        segment_size (int | None): If given, long witnesses are split at stable anchor
+            tokens into segments of roughly this many tokens, which are collated in
+            parallel and stitched back together (see get_segmented_collatex_output)
+        stats (CollationStats | None): If given, the run is instrumented and its
+            statistics recorded in it (see escriptorium_collate.stats)
+        jsonl (bool): If true and CollatexArgs.output is set, the alignment table is
+            written to it in JSON Lines, streamed as it is parsed unless segment_size is
+            given (see write_collatex_output_jsonl), and None is returned
+        order_witnesses (bool): If true, the witnesses are collated in the order of a
+            guide tree of their similarity (see escriptorium_collate.order); the output
+            witnesses are still sorted by siglum
+        segment_workers (int | None): Maximum number of segments collated at once if
+            segment_size is given; defaults to the number of processors
 
     Returns:
-        dict: CollateX JSON output
+        dict | None: CollateX JSON output
     """
-    if not collatex_args.input or not os.path.exists(collatex_args.input):
-        input_json = get_collatex_input(
-            escr=escr,
-            witnesses=witnesses,
-            collatex_args=collatex_args,
-        )
-
-    if collatex_args.input:
-        with open(collatex_args.input, "w", encoding="UTF-8") as file:
-            json.dump(input_json, file, ensure_ascii=False)
-        output_json = get_collatex_output(collatex_args=collatex_args)
+    if stats is None:
+        stats_context = contextlib.nullcontext()
     else:
-        with tempfile.NamedTemporaryFile(mode="w") as file:
-            json.dump(input_json, file, ensure_ascii=False)
-            collatex_args.input = file.name
-            file.flush()
-            output_json = get_collatex_output(collatex_args=collatex_args)
-
-    if collatex_args.output:
-        with open(collatex_args.output, "w", encoding="UTF-8") as file:
-            json.dump(output_json, file, ensure_ascii=False)
+        stats_context = stats.profiling()
+
+    with stats_context, stage(stats, "collate"):
+        if collatex_args.input and os.path.exists(collatex_args.input):
+            with stage(stats, "read_input"):
+                with open(collatex_args.input, encoding=collatex_args.input_encoding or "UTF-8") as file:
+                    input_json = json.load(file)
+        else:
+            with stage(stats, "get_collatex_input"):
+                input_json = get_collatex_input(
+                    escr=escr,
+                    witnesses=witnesses,
+                    collatex_args=collatex_args,
+                    max_workers=max_workers,
+                    cache=cache,
+                    stats=stats,
+                )
+            if collatex_args.input:
+                with stage(stats, "write_input_file"), open(collatex_args.input, "w", encoding="UTF-8") as file:
+                    json.dump(input_json, file, ensure_ascii=False)
+
+        if order_witnesses:
+            from escriptorium_collate import order
+
+            with stage(stats, "order_witnesses"):
+                input_json = order.order_witnesses(input_json)
+
+        if jsonl and collatex_args.output and not segment_size:
+            with stage(stats, "get_collatex_output"):
+                write_collatex_output_jsonl(
+                    collatex_args=collatex_args, input_json=input_json, server=server, stats=stats
+                )
+            return None
+
+        with stage(stats, "get_collatex_output"):
+            if segment_size:
+                output_json = get_segmented_collatex_output(
+                    collatex_args=collatex_args,
+                    input_json=input_json,
+                    segment_size=segment_size,
+                    max_workers=segment_workers,
+                    server=server,
+                    stats=stats,
+                )
+            else:
+                output_json = get_collatex_output(
+                    collatex_args=collatex_args, server=server, input_json=input_json, stats=stats
+                )
+
+        if collatex_args.output:
+            with stage(stats, "write_output_file"), open(collatex_args.output, "w", encoding="UTF-8") as file:
+                if not jsonl:
+                    json.dump(output_json, file, ensure_ascii=False)
+                    return output_json
+                for index, column in enumerate(output_json["table"]):
+                    cells = dict(zip(output_json["witnesses"], column))
+                    json.dump(AlignmentColumn(index, cells)._asdict(), file, ensure_ascii=False)
+                    file.write("\n")
+                return None
 
     return output_json
@@ -0,0 +1,290 @@
+import numpy as np
+
+try:
+    from typing import Dict, List, Literal, Set
+except ImportError:
+    from typing_extensions import Dict, List, Literal, Set
+
+MATCH = 1
+MISMATCH = -1
+GAP = -1
+NEG = np.iinfo(np.int64).min // 4
+
+DIAGONAL = 0
+UP = 1
+LEFT = 2
+
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    """
+    Return the Levenshtein distance between two strings,
+    or limit + 1 as soon as it is known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletions(value: str, distance: int) -> Set[str]:
+    variants = {value}
+    frontier = {value}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1 :] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+    return variants
+
+
+class _Vocabulary:
+    """
+    Integer encoding of token comparison strings, together with the set of
+    codes each code is considered equal to by the token comparator.
+    """
+
+    def __init__(self, token_comparator: Literal["equality", "levenshtein"], distance: int):
+        self.token_comparator = token_comparator
+        self.distance = distance
+        self.codes: Dict[str, int] = {}
+        self.strings: List[str] = []
+        self._deletions: Dict[str, Set[int]] = {}
+        self._matches: Dict[int, List[int]] = {}
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.codes[value] = code
+            self.strings.append(value)
+            if self.token_comparator == "levenshtein":
+                for variant in _deletions(value, self.distance):
+                    self._deletions.setdefault(variant, set()).add(code)
+        return code
+
+    def matches(self, code: int) -> List[int]:
+        """
+        Return the codes matching a given code, including itself.
+        """
+        if self.token_comparator == "equality":
+            return [code]
+        matches = self._matches.get(code)
+        if matches is None:
+            value = self.strings[code]
+            candidates = set()
+            for variant in _deletions(value, self.distance):
+                candidates |= self._deletions.get(variant, set())
+            matches = [
+                candidate
+                for candidate in candidates
+                if levenshtein(value, self.strings[candidate], self.distance) <= self.distance
+            ]
+            self._matches[code] = matches
+        return matches
+
+
+def align(
+    codes: np.ndarray,
+    columns: List[Set[int]],
+    vocabulary: _Vocabulary,
+    band: int | None = None,
+) -> List[tuple]:
+    """
+    Align a sequence of integer-encoded tokens against the columns of an
+    alignment with Needleman-Wunsch, vectorized row by row with NumPy.
+
+    The linear gap penalty turns the left-to-right dependency within a row into
+    a running maximum, so that every row is computed with a few array operations.
+
+    Args:
+        codes (np.ndarray): Integer-encoded tokens of the witness to be aligned
+        columns (List[Set[int]]): Codes present in each column of the alignment
+        vocabulary (_Vocabulary): Vocabulary the codes belong to
+        band (int | None): If given, only cells within this distance of the
+            diagonal are computed (banded alignment)
+
+    Returns:
+        List[tuple]: Pairs of (token index | None, column index | None), in order
+    """
+    n = len(codes)
+    m = len(columns)
+
+    column_positions: Dict[int, List[int]] = {}
+    for index, column in enumerate(columns):
+        for code in column:
+            column_positions.setdefault(code, []).append(index + 1)
+    positions = {code: np.asarray(indices, dtype=np.int64) for code, indices in column_positions.items()}
+    empty = np.empty(0, dtype=np.int64)
+
+    if band is not None:
+        band = max(band, -(-m // max(n, 1)) + 1)
+
+    def window(i):
+        if band is None or i == 0:
+            return 0, m
+        center = round(i * m / n)
+        return max(0, center - band), min(m, center + band)
+
+    offsets = np.arange(m + 1, dtype=np.int64)
+    previous = offsets * GAP
+    current = np.full(m + 1, NEG, dtype=np.int64)
+    directions = [(0, np.full(m + 1, LEFT, dtype=np.int8))]
+    previous_lo, previous_hi = 0, m
+
+    for i in range(1, n + 1):
+        lo, hi = window(i)
+        cols = offsets[lo : hi + 1]
+
+        scores = np.full(hi - lo + 1, MISMATCH, dtype=np.int64)
+        for code in vocabulary.matches(int(codes[i - 1])):
+            matched = positions.get(code, empty)
+            if band is not None:
+                matched = matched[(matched >= lo) & (matched <= hi)]
+            scores[matched - lo] = MATCH
+
+        up = previous[lo : hi + 1] + GAP
+        diagonal = np.full(hi - lo + 1, NEG, dtype=np.int64)
+        start = 1 if lo == 0 else 0
+        diagonal[start:] = previous[lo - 1 + start : hi] + scores[start:]
+        best = np.maximum(diagonal, up)
+        row = np.maximum.accumulate(best - GAP * cols) + GAP * cols
+
+        direction = np.where(diagonal >= up, DIAGONAL, UP).astype(np.int8)
+        direction[row > best] = LEFT
+        directions.append((lo, direction))
+
+        previous[previous_lo : previous_hi + 1] = NEG
+        current[lo : hi + 1] = row
+        previous, current = current, previous
+        previous_lo, previous_hi = lo, hi
+
+    pairs = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        lo, direction = directions[i]
+        move = LEFT if i == 0 else UP if j == 0 else direction[j - lo]
+        if move == DIAGONAL:
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif move == UP:
+            pairs.append((i - 1, None))
+            i -= 1
+        else:
+            pairs.append((None, j - 1))
+            j -= 1
+    pairs.reverse()
+    return pairs
+
+
+def _join_segments(columns: List[Dict[int, list]], keys: List[Dict[int, int]]) -> List[Dict[int, list]]:
+    """
+    Join consecutive columns in which the same witnesses are present and agree
+    with one another in the same way, mirroring the segments of CollateX.
+    """
+    joined: List[Dict[int, list]] = []
+    previous_partition = None
+    for column, key in zip(columns, keys):
+        groups: Dict[int, list] = {}
+        for witness, code in key.items():
+            groups.setdefault(code, []).append(witness)
+        partition = frozenset(frozenset(group) for group in groups.values())
+        if joined and partition == previous_partition:
+            for witness, tokens in column.items():
+                joined[-1][witness].extend(tokens)
+        else:
+            joined.append({witness: list(tokens) for witness, tokens in column.items()})
+        previous_partition = partition
+    return joined
+
+
+def collate_input(
+    input_json: dict,
+    *,
+    tokenized: bool = False,
+    band: int | None = None,
+) -> dict:
+    """
+    Collate CollateX input JSON in-process with progressive Needleman-Wunsch
+    alignment, and return output in the shape of CollateX's JSON table: the
+    sigla sorted as CollateX sorts them, and a list of columns holding one cell
+    per witness in that order.
+
+    Witnesses are added to the alignment one at a time, in the given order.
+    Tokens are compared on their "n" value if present and on their "t" value
+    otherwise, using the token comparator given in the input JSON.
+
+    Args:
+        input_json (dict): CollateX input JSON
+        tokenized (bool): If true, consecutive matches are not joined to segments
+        band (int | None): If given, restrict each alignment to a band of this
+            width around the diagonal
+
+    Raises:
+        ValueError: An error is raised if the input JSON asks for another algorithm
+            than "needleman-wunsch".
+
+    Returns:
+        dict: CollateX output JSON
+    """
+    algorithm = input_json.get("algorithm") or "needleman-wunsch"
+    if algorithm != "needleman-wunsch":
+        error = f'The python engine only supports the "needleman-wunsch" algorithm, not "{algorithm}"'
+        raise ValueError(error)
+
+    token_comparator = input_json.get("tokenComparator") or {}
+    distance = token_comparator.get("distance")
+    vocabulary = _Vocabulary(
+        token_comparator=token_comparator.get("type") or "equality",
+        distance=1 if distance is None else distance,
+    )
+
+    sigla = [witness["id"] for witness in input_json["witnesses"]]
+    columns: List[Dict[int, list]] = []
+    keys: List[Dict[int, int]] = []
+    column_codes: List[Set[int]] = []
+
+    for witness_index, witness in enumerate(input_json["witnesses"]):
+        tokens = witness["tokens"]
+        codes = np.fromiter(
+            (vocabulary.encode(token.get("n", token["t"])) for token in tokens),
+            dtype=np.int64,
+            count=len(tokens),
+        )
+
+        if not columns:
+            pairs = [(index, None) for index in range(len(tokens))]
+        else:
+            pairs = align(codes, column_codes, vocabulary, band=band)
+
+        merged_columns, merged_keys, merged_codes = [], [], []
+        for token_index, column_index in pairs:
+            if column_index is None:
+                column, key, codes_in_column = {}, {}, set()
+            else:
+                column, key, codes_in_column = columns[column_index], keys[column_index], column_codes[column_index]
+            if token_index is not None:
+                code = int(codes[token_index])
+                column[witness_index] = [dict(tokens[token_index])]
+                matches = set(vocabulary.matches(code))
+                key[witness_index] = next(
+                    (other for other in key.values() if other in matches),
+                    code,
+                )
+                codes_in_column.add(code)
+            merged_columns.append(column)
+            merged_keys.append(key)
+            merged_codes.append(codes_in_column)
+        columns, keys, column_codes = merged_columns, merged_keys, merged_codes
+
+    if not tokenized:
+        columns = _join_segments(columns, keys)
+
+    order = sorted(range(len(sigla)), key=sigla.__getitem__)
+    table = [[column.get(witness_index, []) for witness_index in order] for column in columns]
+
+    return {"witnesses": [sigla[witness_index] for witness_index in order], "table": table}
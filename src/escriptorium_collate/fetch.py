@@ -0,0 +1,107 @@
+import time
+
+try:
+    from typing import TYPE_CHECKING, Callable, Dict, List, TypeVar
+except ImportError:
+    from typing_extensions import TYPE_CHECKING, Callable, Dict, List, TypeVar
+
+if TYPE_CHECKING:
+    from escriptorium_connector import EscriptoriumConnector
+    from escriptorium_connector.dtos import GetTranscription
+
+T = TypeVar("T")
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def with_retry(
+    func: Callable[..., T],
+    *args,
+    retries: int = 5,
+    backoff_factor: float = 1.0,
+    **kwargs,
+) -> T:
+    """
+    Call a connector method, retrying with exponential backoff when
+    eScriptorium answers with 429 (Too Many Requests) or a 5xx status.
+
+    Args:
+        func (Callable): The connector method to be called
+        retries (int): Maximum number of retries
+        backoff_factor (float): Seconds to wait before the first retry;
+            doubled on every subsequent retry. A Retry-After header takes precedence.
+
+    Raises:
+        EscriptoriumConnectorHttpError: Re-raised once the retries are exhausted,
+            or immediately for any other status
+
+    Returns:
+        The return value of func
+    """
+    from escriptorium_connector.connector_errors import EscriptoriumConnectorHttpError
+
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except EscriptoriumConnectorHttpError as err:
+            response = getattr(err.error, "response", None)
+            status_code = getattr(response, "status_code", None)
+            if attempt >= retries or status_code not in RETRY_STATUS_CODES:
+                raise
+            delay = backoff_factor * 2**attempt
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                delay = float(retry_after)
+            time.sleep(delay)
+            attempt += 1
+
+
+def get_part_line_transcriptions(
+    escr: "EscriptoriumConnector",
+    doc_pk: int,
+    part_pk: int,
+) -> Dict[int, Dict[int, "GetTranscription"]]:
+    """
+    Fetch every line transcription of a given document part
+    in one (paginated) bulk call and index it in memory.
+
+    Args:
+        escr (EscriptoriumConnector): An EscriptoriumConnector instance
+        doc_pk (int): Primary key of an eScriptorium document
+        part_pk (int): Primary key of a part of that document
+
+    Returns:
+        dict: Line transcriptions keyed as {line_pk: {transcription_pk: line_transcription}}
+    """
+    index: Dict[int, Dict[int, "GetTranscription"]] = {}
+    line_transcriptions = with_retry(
+        escr.get_document_part_transcriptions,
+        doc_pk=doc_pk,
+        part_pk=part_pk,
+    ).results
+    for line_transcription in line_transcriptions:
+        index.setdefault(line_transcription.line, {})[line_transcription.transcription] = line_transcription
+    return index
+
+
+def get_document_line_transcriptions(
+    escr: "EscriptoriumConnector",
+    doc_pk: int,
+    part_pks: List[int] | None = None,
+) -> Dict[int, Dict[int, Dict[int, "GetTranscription"]]]:
+    """
+    Fetch every line transcription of a given document, one bulk call per part.
+
+    Args:
+        escr (EscriptoriumConnector): An EscriptoriumConnector instance
+        doc_pk (int): Primary key of an eScriptorium document
+        part_pks (List[int] | None): Primary keys of the parts to be fetched;
+            if omitted, all parts of the document are fetched
+
+    Returns:
+        dict: Line transcriptions keyed as {part_pk: {line_pk: {transcription_pk: line_transcription}}}
+    """
+    if part_pks is None:
+        part_pks = [part.pk for part in with_retry(escr.get_document_parts, doc_pk=doc_pk).results]
+    return {part_pk: get_part_line_transcriptions(escr=escr, doc_pk=doc_pk, part_pk=part_pk) for part_pk in part_pks}
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from typing import TYPE_CHECKING, List, Tuple
+except ImportError:
+    from typing_extensions import TYPE_CHECKING, List, Tuple
+
+from escriptorium_collate import segment
+from escriptorium_collate.collate import (
+    CollatexArgs,
+    Witness,
+    _get_transcription_layer_pks,
+    get_collatex_output,
+    get_part_tokens,
+    get_segmented_collatex_output,
+    make_collatex_input,
+)
+from escriptorium_collate.fetch import with_retry
+from escriptorium_collate.server import CollatexServer
+from escriptorium_collate.tokens import WitnessTokens
+from escriptorium_collate.transcription_layers import get_layer_registry
+
+if TYPE_CHECKING:
+    from escriptorium_connector import EscriptoriumConnector
+
+
+def get_part_hash(tokens: WitnessTokens) -> str:
+    """
+    Return a content hash of the tokens of a document part.
+
+    Args:
+        tokens (WitnessTokens): CollateX tokens of the part
+
+    Returns:
+        str: A SHA-256 hex digest
+    """
+    return hashlib.sha256(json.dumps(tokens.to_columns(), ensure_ascii=False).encode("UTF-8")).hexdigest()
+
+
+def get_witness_part_tokens(
+    escr: "EscriptoriumConnector",
+    witnesses: List[Witness],
+    max_workers: int = 1,
+) -> List[List[Tuple[int, WitnessTokens]]]:
+    """
+    Return the CollateX tokens of every part of every witness.
+
+    Args:
+        escr (EscriptoriumConnector): An EscriptoriumConnector instance
+        witnesses (List[Witness]): A list of Witness instances
+        max_workers (int): Maximum number of requests to eScriptorium in flight at once
+
+    Returns:
+        List[List[Tuple[int, WitnessTokens]]]: For each witness, pairs of (part primary key, tokens) in part order
+    """
+    get_layer_registry(escr).load([witness.doc_pk for witness in witnesses], max_workers=max_workers)
+    layer_pks = [_get_transcription_layer_pks(escr, witness) for witness in witnesses]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        parts = list(
+            executor.map(
+                lambda witness: with_retry(escr.get_document_parts, doc_pk=witness.doc_pk).results,
+                witnesses,
+            )
+        )
+        jobs = [
+            (witness.doc_pk, part.pk, *layer_pks[index])
+            for index, witness in enumerate(witnesses)
+            for part in parts[index]
+        ]
+        part_tokens = iter(executor.map(lambda job: get_part_tokens(escr, *job), jobs))
+        return [[(part.pk, next(part_tokens)) for part in witness_parts] for witness_parts in parts]
+
+
+def _get_changed_range(old_parts: list, new_parts: list) -> Tuple[int, int] | None:
+    """
+    Compare the [part_pk, hash, token_count] entries of two revisions of a witness
+    and return the range of old token indices covered by the changed parts,
+    or None if no part changed.
+    """
+    prefix = 0
+    while prefix < min(len(old_parts), len(new_parts)) and old_parts[prefix][:2] == new_parts[prefix][:2]:
+        prefix += 1
+    if prefix == len(old_parts) == len(new_parts):
+        return None
+    suffix = 0
+    while (
+        suffix < min(len(old_parts), len(new_parts)) - prefix
+        and old_parts[-1 - suffix][:2] == new_parts[-1 - suffix][:2]
+    ):
+        suffix += 1
+    start = sum(count for _, _, count in old_parts[:prefix])
+    end = sum(count for _, _, count in old_parts[: len(old_parts) - suffix])
+    return start, end
+
+
+def _is_anchor_column(column: list) -> bool:
+    """
+    Return whether every witness has tokens in a column of the alignment table,
+    and all of them agree.
+    """
+    if not all(column):
+        return False
+    return len({tuple(token.get("n", token["t"]) for token in cell) for cell in column}) == 1
+
+
+def _recollate(
+    collatex_args: CollatexArgs,
+    input_json: dict,
+    output_json: dict,
+    old_parts: dict,
+    new_parts: dict,
+    server: CollatexServer | None = None,
+) -> dict:
+    """
+    Re-collate the region of a stored alignment table affected by changed parts
+    and splice it into the table.
+    """
+    sigla = output_json["witnesses"]
+    table = output_json["table"]
+    width = len(table)
+
+    lo, hi = width, 0
+    for witness_index, siglum in enumerate(sigla):
+        changed = _get_changed_range(old_parts[siglum], new_parts[siglum])
+        if changed is None:
+            continue
+        start, end = changed
+        columns = [column_index for column_index, column in enumerate(table) for _ in column[witness_index]]
+        if start == len(columns):
+            lo, hi = min(lo, width), width
+        else:
+            lo = min(lo, columns[start])
+            hi = max(hi, columns[max(start, end - 1)] + 1)
+    if lo > hi:
+        return output_json
+
+    # Widen the region to the nearest columns on which all witnesses agree.
+    while lo > 0 and not _is_anchor_column(table[lo - 1]):
+        lo -= 1
+    while hi < width and not _is_anchor_column(table[hi]):
+        hi += 1
+
+    witness_indexes = {siglum: index for index, siglum in enumerate(sigla)}
+    region_json = {key: value for key, value in input_json.items() if key != "witnesses"}
+    region_json["witnesses"] = []
+    for witness in input_json["witnesses"]:
+        witness_index = witness_indexes[witness["id"]]
+        counts = [len(column[witness_index]) for column in table]
+        start = sum(counts[:lo])
+        end = start + sum(counts[lo:hi]) + len(witness["tokens"]) - sum(counts)
+        tokens = witness["tokens"][start:end]
+        if tokens:
+            region_json["witnesses"].append({"id": witness["id"], "tokens": tokens})
+
+    if region_json["witnesses"]:
+        region_output = get_collatex_output(collatex_args=collatex_args, server=server, input_json=region_json)
+    else:
+        region_output = {"witnesses": [], "table": []}
+
+    return segment.stitch_outputs(
+        sigla=sigla,
+        outputs=[
+            {"witnesses": sigla, "table": table[:lo]},
+            region_output,
+            {"witnesses": sigla, "table": table[hi:]},
+        ],
+    )
+
+
+def collate_incremental(
+    escr: "EscriptoriumConnector",
+    witnesses: List[Witness],
+    collatex_args: CollatexArgs,
+    state_path: str,
+    max_workers: int = 1,
+    server: CollatexServer | None = None,
+    segment_size: int | None = None,
+):
+    """
+    Run the collation pipeline, re-collating only what changed since the last run.
+
+    The output table and a content hash of every part of every witness are stored
+    in a JSON file at state_path. On the next run, the changed parts of each witness
+    are located in the stored table; only the region around them, bounded by the
+    nearest columns on which all witnesses agree, is collated again and spliced into
+    the table. If there is no stored state, or the witnesses or CollateX arguments
+    differ from the stored ones, everything is collated.
+
+    Args:
+        escr (EscriptoriumConnector): An EscriptoriumConnector instance
+        witnesses (List[Witness]): A list of Witness instances
+        collatex_args (CollatexArgs): An instance of CollatexArgs with format "json"
+        state_path (str): Path of the JSON file holding the state of the last run
+        max_workers (int): Maximum number of requests to eScriptorium in flight at once
+        server (CollatexServer | None): A CollatexServer instance to collate with,
+            instead of starting a new JVM
+        segment_size (int | None): If given, a full collation is split into segments
+            of roughly this many tokens (see get_segmented_collatex_output)
+
+    Raises:
+        ValueError: An error is raised if the output format is not "json".
+        RuntimeError: An error is raised if CollateX fails.
+
+    Returns:
+        dict: CollateX JSON output
+    """
+    if collatex_args.format != "json":
+        error = f"Incremental collation requires the json output format, not {collatex_args.format}"
+        raise ValueError(error)
+
+    witness_parts = get_witness_part_tokens(escr=escr, witnesses=witnesses, max_workers=max_workers)
+    parts = {
+        witness.siglum: [[part_pk, get_part_hash(tokens), len(tokens)] for part_pk, tokens in part_tokens]
+        for witness, part_tokens in zip(witnesses, witness_parts)
+    }
+    witness_tokens = []
+    for witness, part_tokens in zip(witnesses, witness_parts):
+        tokens = WitnessTokens(witness.doc_pk)
+        for _, tokens_of_part in part_tokens:
+            tokens.extend(tokens_of_part)
+        witness_tokens.append((witness.siglum, tokens))
+    input_json = make_collatex_input(collatex_args=collatex_args, witness_tokens=witness_tokens)
+    sigla = sorted(witness["id"] for witness in input_json["witnesses"])
+    args = collatex_args.dict(exclude={"input", "output"})
+
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path, encoding="UTF-8") as file:
+            state = json.load(file)
+
+    if state is not None and state["collatex_args"] == args and state["output"]["witnesses"] == sigla:
+        output_json = _recollate(
+            collatex_args=collatex_args,
+            input_json=input_json,
+            output_json=state["output"],
+            old_parts=state["parts"],
+            new_parts=parts,
+            server=server,
+        )
+    elif segment_size:
+        output_json = get_segmented_collatex_output(
+            collatex_args=collatex_args,
+            input_json=input_json,
+            segment_size=segment_size,
+            server=server,
+        )
+    else:
+        output_json = get_collatex_output(collatex_args=collatex_args, server=server, input_json=input_json)
+
+    with open(f"{state_path}.tmp", "w", encoding="UTF-8") as file:
+        json.dump({"collatex_args": args, "parts": parts, "output": output_json}, file, ensure_ascii=False)
+    os.replace(f"{state_path}.tmp", state_path)
+
+    if collatex_args.output:
+        with open(collatex_args.output, "w", encoding="UTF-8") as file:
+            json.dump(output_json, file, ensure_ascii=False)
+
+    return output_json
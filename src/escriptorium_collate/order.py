@@ -0,0 +1,176 @@
+import zlib
+
+import numpy as np
+
+try:
+    from typing import List
+except ImportError:
+    from typing_extensions import List
+
+# Hash values are taken modulo this prime; as shingle hashes are below 2**32
+# and coefficients below 2**31, a * x + b never overflows an unsigned 64-bit integer.
+PRIME = (1 << 31) - 1
+
+# Sketch value of witnesses without tokens, above every hash value.
+EMPTY = PRIME
+
+# Number of shingles hashed at once, bounding the memory of the hash matrix.
+CHUNK_SIZE = 4096
+
+
+def _get_key(token: dict) -> str:
+    return token.get("n", token["t"])
+
+
+def _get_shingle_hashes(tokens: List[dict], shingle_size: int) -> np.ndarray:
+    keys = [_get_key(token) for token in tokens]
+    if not keys:
+        return np.empty(0, dtype=np.uint64)
+    size = min(shingle_size, len(keys))
+    return np.fromiter(
+        (zlib.crc32("\x1f".join(keys[index : index + size]).encode()) for index in range(len(keys) - size + 1)),
+        dtype=np.uint64,
+    )
+
+
+def get_minhash_sketches(
+    input_json: dict,
+    shingle_size: int = 3,
+    num_hashes: int = 128,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Compute a MinHash sketch of the token shingles of every witness.
+
+    Tokens are compared on their "n" value if present and on their "t" value otherwise.
+
+    Args:
+        input_json (dict): CollateX input JSON
+        shingle_size (int): Number of consecutive tokens per shingle
+        num_hashes (int): Number of hash functions, i.e. length of each sketch
+        seed (int): Seed of the hash functions
+
+    Returns:
+        np.ndarray: One sketch per witness, in input order
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, num_hashes, dtype=np.uint64)
+    b = rng.integers(0, PRIME, num_hashes, dtype=np.uint64)
+    sketches = np.full((len(input_json["witnesses"]), num_hashes), EMPTY, dtype=np.uint64)
+    for index, witness in enumerate(input_json["witnesses"]):
+        hashes = _get_shingle_hashes(witness["tokens"], shingle_size)
+        for start in range(0, len(hashes), CHUNK_SIZE):
+            values = (hashes[start : start + CHUNK_SIZE, None] * a + b) % PRIME
+            np.minimum(sketches[index], values.min(axis=0), out=sketches[index])
+    return sketches
+
+
+def get_similarity_matrix(sketches: np.ndarray) -> np.ndarray:
+    """
+    Estimate the Jaccard similarity of the shingles of every pair of witnesses
+    from their MinHash sketches. Witnesses without tokens are similar to none.
+
+    Args:
+        sketches (np.ndarray): Sketches returned by get_minhash_sketches
+
+    Returns:
+        np.ndarray: Symmetric matrix of similarities between 0 and 1
+    """
+    matches = (sketches[:, None, :] == sketches[None, :, :]) & (sketches[:, None, :] != EMPTY)
+    return matches.mean(axis=2)
+
+
+def get_clusters(similarity: np.ndarray, threshold: float | None = None) -> List[List[int]]:
+    """
+    Build a guide tree of the witnesses by average-linkage (UPGMA) clustering,
+    and return the witness indexes in the order of its leaves.
+
+    The two most similar clusters are merged until one cluster is left, or, if
+    threshold is given, until no two clusters are more similar than threshold.
+    When two clusters are merged, the larger one comes first, so the most similar
+    witnesses come first and each following witness is close to those before it,
+    as progressive alignment wants.
+
+    Args:
+        similarity (np.ndarray): Matrix returned by get_similarity_matrix
+        threshold (float | None): Minimum average similarity of merged clusters
+
+    Returns:
+        List[List[int]]: The witness indexes of each cluster, in guide tree order,
+            largest cluster first
+    """
+    count = len(similarity)
+    clusters = [[index] for index in range(count)]
+    sums = np.array(similarity, dtype=np.float64)
+    sizes = np.ones(count)
+    active = np.ones(count, dtype=bool)
+    for _ in range(count - 1):
+        averages = sums / np.outer(sizes, sizes)
+        averages[~active] = -np.inf
+        averages[:, ~active] = -np.inf
+        np.fill_diagonal(averages, -np.inf)
+        first, second = np.unravel_index(np.argmax(averages), averages.shape)
+        if threshold is not None and averages[first, second] < threshold:
+            break
+        if len(clusters[second]) > len(clusters[first]):
+            first, second = second, first
+        clusters[first] = clusters[first] + clusters[second]
+        sums[first] += sums[second]
+        sums[:, first] += sums[:, second]
+        sizes[first] += sizes[second]
+        active[second] = False
+    return sorted(
+        (clusters[index] for index in np.flatnonzero(active)), key=lambda cluster: (-len(cluster), cluster[0])
+    )
+
+
+def order_witnesses(
+    input_json: dict,
+    shingle_size: int = 3,
+    num_hashes: int = 128,
+    seed: int = 0,
+) -> dict:
+    """
+    Reorder the witnesses of CollateX input JSON along a guide tree of their
+    similarity, so that progressive alignment adds the most similar witnesses first.
+
+    Args:
+        input_json (dict): CollateX input JSON
+        shingle_size (int): Number of consecutive tokens per shingle
+        num_hashes (int): Number of hash functions per MinHash sketch
+        seed (int): Seed of the hash functions
+
+    Returns:
+        dict: CollateX input JSON with reordered witnesses
+    """
+    return cluster_witnesses(input_json, threshold=None, shingle_size=shingle_size, num_hashes=num_hashes, seed=seed)[0]
+
+
+def cluster_witnesses(
+    input_json: dict,
+    threshold: float | None,
+    shingle_size: int = 3,
+    num_hashes: int = 128,
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Split CollateX input JSON into clusters of similar witnesses (see get_clusters),
+    each with its witnesses in guide tree order, so that they can be collated separately.
+
+    Args:
+        input_json (dict): CollateX input JSON
+        threshold (float | None): Minimum average estimated Jaccard similarity
+            of the witness shingles within a cluster; if None, one cluster is returned
+        shingle_size (int): Number of consecutive tokens per shingle
+        num_hashes (int): Number of hash functions per MinHash sketch
+        seed (int): Seed of the hash functions
+
+    Returns:
+        List[dict]: CollateX input JSON of each cluster, largest cluster first
+    """
+    witnesses = input_json["witnesses"]
+    if len(witnesses) < 2:
+        return [input_json]
+    sketches = get_minhash_sketches(input_json, shingle_size=shingle_size, num_hashes=num_hashes, seed=seed)
+    clusters = get_clusters(get_similarity_matrix(sketches), threshold=threshold)
+    return [{**input_json, "witnesses": [witnesses[index] for index in cluster]} for cluster in clusters]
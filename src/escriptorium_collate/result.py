@@ -0,0 +1,175 @@
+import json
+
+import numpy as np
+
+try:
+    from typing import Dict, Iterable, List
+except ImportError:
+    from typing_extensions import Dict, Iterable, List
+
+from escriptorium_collate.stream import AlignmentColumn
+
+EMPTY = -1
+
+
+def _get_reading(cell: list) -> tuple:
+    return tuple(token.get("n", token["t"]) for token in cell)
+
+
+class CollationResult:
+    """
+    Indexed view of CollateX output JSON for repeated variant and provenance queries.
+
+    The indexes are built once, in one pass over the columns of the alignment table:
+    the columns holding the tokens of each line and of each document, the token
+    offsets of each witness in each column, the variant columns, and the number
+    of columns in which each pair of witnesses agrees. Cells are compared on the
+    "n" value of their tokens if present and on their "t" value otherwise.
+    """
+
+    def __init__(self, output: dict):
+        """
+        Args:
+            output (dict): CollateX output JSON, e.g. returned by collate
+        """
+        self.sigla: List[str] = list(output["witnesses"])
+        self.table: List[list] = output["table"]
+        self.width = len(self.table)
+        self._witness_indexes = {siglum: index for index, siglum in enumerate(self.sigla)}
+
+        readings: Dict[tuple, int] = {}
+        # Integer code of the reading of every cell, EMPTY for empty cells.
+        self.codes = np.full((len(self.sigla), self.width), EMPTY, dtype=np.int64)
+        # Token offsets of every witness: the tokens of column c are offsets[w, c]:offsets[w, c + 1].
+        self.offsets = np.zeros((len(self.sigla), self.width + 1), dtype=np.int64)
+        counts = np.zeros((len(self.sigla), self.width), dtype=np.int64)
+        line_columns: Dict[int, List[int]] = {}
+        doc_columns: Dict[int, List[int]] = {}
+        self._line_witnesses: Dict[int, int] = {}
+
+        for column_index, column in enumerate(self.table):
+            for witness_index, cell in enumerate(column):
+                if not cell:
+                    continue
+                counts[witness_index, column_index] = len(cell)
+                self.codes[witness_index, column_index] = readings.setdefault(_get_reading(cell), len(readings))
+                for token in cell:
+                    line_pk = token.get("line_pk")
+                    if line_pk is not None:
+                        columns = line_columns.setdefault(line_pk, [])
+                        if not columns or columns[-1] != column_index:
+                            columns.append(column_index)
+                        self._line_witnesses.setdefault(line_pk, witness_index)
+                    doc_pk = token.get("doc_pk")
+                    if doc_pk is not None:
+                        columns = doc_columns.setdefault(doc_pk, [])
+                        if not columns or columns[-1] != column_index:
+                            columns.append(column_index)
+        np.cumsum(counts, axis=1, out=self.offsets[:, 1:])
+
+        self._line_columns = {line_pk: np.asarray(columns) for line_pk, columns in line_columns.items()}
+        self._doc_columns = {doc_pk: np.asarray(columns) for doc_pk, columns in doc_columns.items()}
+
+        if len(self.sigla) > 1:
+            ordered = np.sort(self.codes, axis=0)
+            self.variant_columns = np.flatnonzero((ordered[1:] != ordered[:-1]).any(axis=0))
+        else:
+            self.variant_columns = np.empty(0, dtype=np.int64)
+
+        # agreement[a, b]: number of columns in which witnesses a and b have the same, non-empty reading.
+        self.agreement = np.zeros((len(self.sigla), len(self.sigla)), dtype=np.int64)
+        present = self.codes != EMPTY
+        for witness_index in range(len(self.sigla)):
+            self.agreement[witness_index] = ((self.codes == self.codes[witness_index]) & present[witness_index]).sum(
+                axis=1
+            )
+
+    @classmethod
+    def from_columns(cls, columns: Iterable[AlignmentColumn]) -> "CollationResult":
+        """
+        Build a CollationResult from alignment columns, e.g. yielded by iter_alignment_columns.
+        """
+        sigla: List[str] = []
+        table = []
+        for _, cells in columns:
+            if not table:
+                sigla = list(cells)
+            table.append([cells[siglum] for siglum in sigla])
+        return cls({"witnesses": sigla, "table": table})
+
+    @classmethod
+    def from_file(cls, path: str, encoding: str = "UTF-8") -> "CollationResult":
+        """
+        Load a CollationResult from a CollateX JSON output file, or from a JSON Lines
+        file (ending in .jsonl) as written by write_collatex_output_jsonl.
+        """
+        with open(path, encoding=encoding) as file:
+            if path.endswith(".jsonl"):
+                return cls.from_columns(AlignmentColumn(**json.loads(line)) for line in file if line.strip())
+            return cls(json.load(file))
+
+    def get_line_columns(self, line_pk: int) -> np.ndarray:
+        """
+        Return the columns holding the tokens of a line, in order.
+        """
+        return self._line_columns.get(line_pk, np.empty(0, dtype=np.int64))
+
+    def get_doc_columns(self, doc_pk: int) -> np.ndarray:
+        """
+        Return the columns holding tokens of a document, in order.
+        """
+        return self._doc_columns.get(doc_pk, np.empty(0, dtype=np.int64))
+
+    def get_variant_columns(self, doc_pk: int | None = None, line_pks: Iterable[int] | None = None) -> np.ndarray:
+        """
+        Return the columns in which the witnesses do not all have the same reading,
+        optionally restricted to the columns of a document and/or of given lines
+        (e.g. the lines of a part).
+        """
+        columns = self.variant_columns
+        if doc_pk is not None:
+            columns = np.intersect1d(columns, self.get_doc_columns(doc_pk), assume_unique=True)
+        if line_pks is not None:
+            line_columns = [self.get_line_columns(line_pk) for line_pk in line_pks]
+            columns = np.intersect1d(
+                columns, np.unique(np.concatenate(line_columns)) if line_columns else [], assume_unique=True
+            )
+        return columns
+
+    def get_readings(self, column: int) -> Dict[tuple, List[str]]:
+        """
+        Return the sigla of the witnesses grouped by their reading of a column.
+        Witnesses without tokens in the column are grouped under the empty tuple.
+        """
+        readings: Dict[tuple, List[str]] = {}
+        for siglum, cell in zip(self.sigla, self.table[column]):
+            readings.setdefault(_get_reading(cell), []).append(siglum)
+        return readings
+
+    def get_divergent_witnesses(self, line_pk: int) -> List[str]:
+        """
+        Return the sigla of the witnesses whose reading differs from that of the
+        line's own witness in at least one column of the line.
+        """
+        columns = self.get_line_columns(line_pk)
+        if len(columns) == 0:
+            return []
+        codes = self.codes[:, columns]
+        divergent = (codes != codes[self._line_witnesses[line_pk]]).any(axis=1)
+        return [siglum for siglum, flag in zip(self.sigla, divergent) if flag]
+
+    def get_column(self, siglum: str, token_index: int) -> int:
+        """
+        Return the column holding a given token of a witness.
+        """
+        offsets = self.offsets[self._witness_indexes[siglum]]
+        if not 0 <= token_index < offsets[-1]:
+            error = f"Witness {siglum} has no token {token_index}"
+            raise IndexError(error)
+        return int(np.searchsorted(offsets, token_index, side="right")) - 1
+
+    def get_agreement(self, siglum_a: str, siglum_b: str) -> int:
+        """
+        Return the number of columns in which two witnesses have the same, non-empty reading.
+        """
+        return int(self.agreement[self._witness_indexes[siglum_a], self._witness_indexes[siglum_b]])
@@ -0,0 +1,126 @@
+from bisect import bisect_left
+from collections import Counter
+
+try:
+    from typing import List
+except ImportError:
+    from typing_extensions import List
+
+
+def _get_key(token: dict) -> str:
+    return token.get("n", token["t"])
+
+
+def _increasing_subsequence(indices: List[int], values: List[int]) -> List[int]:
+    """
+    Return the longest subsequence of indices whose values are strictly increasing.
+    """
+    tails: List[int] = []
+    tail_indices: List[int] = []
+    parents = {}
+    for index in indices:
+        value = values[index]
+        position = bisect_left(tails, value)
+        parents[index] = tail_indices[position - 1] if position > 0 else None
+        if position == len(tails):
+            tails.append(value)
+            tail_indices.append(index)
+        else:
+            tails[position] = value
+            tail_indices[position] = index
+    subsequence = []
+    index = tail_indices[-1] if tail_indices else None
+    while index is not None:
+        subsequence.append(index)
+        index = parents[index]
+    subsequence.reverse()
+    return subsequence
+
+
+def find_anchors(input_json: dict) -> List[List[int]]:
+    """
+    Find stable anchor tokens: tokens that occur exactly once in every witness,
+    in the same relative order everywhere.
+
+    Args:
+        input_json (dict): CollateX input JSON
+
+    Returns:
+        List[List[int]]: For each anchor, in order, its token index in every witness
+    """
+    witnesses = input_json["witnesses"]
+    if not witnesses:
+        return []
+
+    positions = []
+    for witness in witnesses:
+        counts = Counter(_get_key(token) for token in witness["tokens"])
+        positions.append(
+            {_get_key(token): index for index, token in enumerate(witness["tokens"]) if counts[_get_key(token)] == 1}
+        )
+    keys = set(positions[0])
+    for witness_positions in positions[1:]:
+        keys &= set(witness_positions)
+
+    anchors = sorted([witness_positions[key] for witness_positions in positions] for key in keys)
+    # Keep a chain of anchors that is in order in every witness.
+    chain = list(range(len(anchors)))
+    for witness_index in range(1, len(witnesses)):
+        chain = _increasing_subsequence(chain, [anchor[witness_index] for anchor in anchors])
+    return [anchors[index] for index in chain]
+
+
+def split_input(input_json: dict, segment_size: int) -> List[dict]:
+    """
+    Split CollateX input JSON into segments at anchor tokens, so that every
+    segment holds roughly segment_size tokens of the first witness and can be
+    collated independently.
+
+    Args:
+        input_json (dict): CollateX input JSON
+        segment_size (int): Target number of tokens per segment
+
+    Returns:
+        List[dict]: CollateX input JSON for each segment. Witnesses without tokens
+            in a segment are left out of it.
+    """
+    boundaries = []
+    for anchor in find_anchors(input_json):
+        if anchor[0] >= (boundaries[-1][0] if boundaries else 0) + segment_size:
+            boundaries.append(anchor)
+
+    segments = []
+    for segment_index in range(len(boundaries) + 1):
+        segment = {key: value for key, value in input_json.items() if key != "witnesses"}
+        segment["witnesses"] = []
+        for witness_index, witness in enumerate(input_json["witnesses"]):
+            start = boundaries[segment_index - 1][witness_index] if segment_index > 0 else 0
+            end = boundaries[segment_index][witness_index] if segment_index < len(boundaries) else None
+            tokens = witness["tokens"][start:end]
+            if tokens:
+                segment["witnesses"].append({**witness, "tokens": tokens})
+        segments.append(segment)
+    return segments
+
+
+def stitch_outputs(sigla: List[str], outputs: List[dict]) -> dict:
+    """
+    Stitch the CollateX outputs of consecutive segments into one alignment table.
+
+    The columns of the segments are concatenated, their cells rearranged from
+    the witnesses of each segment into the order of sigla; witnesses without
+    tokens in a segment get empty cells there.
+
+    Args:
+        sigla (List[str]): Sigla of all witnesses, in the order of the cells of the stitched columns
+        outputs (List[dict]): CollateX output JSON of each segment, in order
+
+    Returns:
+        dict: CollateX output JSON
+    """
+    table: List[list] = []
+    for output in outputs:
+        indexes = {siglum: index for index, siglum in enumerate(output["witnesses"])}
+        order = [indexes.get(siglum) for siglum in sigla]
+        table.extend([[] if index is None else column[index] for index in order] for column in output["table"])
+    return {"witnesses": list(sigla), "table": table}
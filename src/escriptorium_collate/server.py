@@ -0,0 +1,205 @@
+import atexit
+import json
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    from importlib.resources import files
+except ImportError:
+    from importlib_resources import files
+
+ACCEPT_HEADERS = {
+    "json": "application/json",
+    "tei": "application/tei+xml",
+    "graphml": "application/graphml+xml",
+    "dot": "text/plain",
+}
+
+
+def get_jar_path() -> str:
+    """
+    Return the path of the bundled CollateX Jar.
+    """
+    return str(files("escriptorium_collate") / "__assets__" / "collatex-tools-1.7.1.jar")
+
+
+def _get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class CollatexServer:
+    """
+    A long-lived CollateX process running the bundled Jar in HTTP server mode.
+
+    The JVM is started once, on first use, and every collation is posted to it,
+    so that JVM startup and JIT warm-up are paid once per Python process rather
+    than once per collation. The server is restarted if it crashes and shut down
+    when the Python process exits.
+    """
+
+    def __init__(
+        self,
+        port: int | None = None,
+        java: str = "java",
+        max_collation_size: int | None = None,
+        max_parallel_collations: int | None = None,
+        dot_path: str | None = None,
+        startup_timeout: float = 60.0,
+        request_timeout: float | None = None,
+    ):
+        """
+        Args:
+            port (int | None): Port to bind the server to; a free port is chosen if omitted
+            java (str): Java executable
+            max_collation_size (int | None): Passed to CollateX as -mcs
+            max_parallel_collations (int | None): Passed to CollateX as -mpc
+            dot_path (str | None): Passed to CollateX as -dot
+            startup_timeout (float): Seconds to wait for the server to accept connections
+            request_timeout (float | None): Seconds to wait for a collation to complete
+        """
+        self.port = port
+        self.java = java
+        self.max_collation_size = max_collation_size
+        self.max_parallel_collations = max_parallel_collations
+        self.dot_path = dot_path
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        self._process: subprocess.Popen | None = None
+        self._stderr = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/collate"
+
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """
+        Start the server unless it is already running.
+
+        Raises:
+            RuntimeError: An error is raised if the server exits or does not
+                accept connections within startup_timeout.
+        """
+        with self._lock:
+            if self.is_running():
+                return
+            if self.port is None:
+                self.port = _get_free_port()
+
+            args = [self.java, "-jar", get_jar_path(), "-S", "-p", str(self.port)]
+            if self.max_collation_size:
+                args.extend(["-mcs", str(self.max_collation_size)])
+            if self.max_parallel_collations:
+                args.extend(["-mpc", str(self.max_parallel_collations)])
+            if self.dot_path:
+                args.extend(["-dot", self.dot_path])
+
+            self._stderr = tempfile.TemporaryFile()
+            self._process = subprocess.Popen(
+                args,
+                stdout=subprocess.DEVNULL,
+                stderr=self._stderr,
+            )
+
+            deadline = time.monotonic() + self.startup_timeout
+            while time.monotonic() < deadline:
+                if self._process.poll() is not None:
+                    self._stderr.seek(0)
+                    error = f"CollateX server failed: {self._process.returncode} {self._stderr.read()}"
+                    self._stop()
+                    raise RuntimeError(error)
+                try:
+                    with socket.create_connection(("127.0.0.1", self.port), timeout=0.5):
+                        return
+                except OSError:
+                    time.sleep(0.1)
+
+            self._stop()
+            error = f"CollateX server did not start within {self.startup_timeout} seconds"
+            raise RuntimeError(error)
+
+    def stop(self):
+        """
+        Shut the server down if it is running.
+        """
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        if self._stderr is not None:
+            self._stderr.close()
+        self._process = None
+        self._stderr = None
+
+    def collate(
+        self,
+        input_json: dict,
+        output_format: str = "json",
+        *,
+        tokenized: bool = False,
+        object_hook=None,
+    ):
+        """
+        Post CollateX input JSON to the server, starting or restarting it if needed.
+
+        Args:
+            input_json (dict): CollateX input JSON
+            output_format (str): One of "json", "tei", "graphml" or "dot"
+            tokenized (bool): If true, consecutive matches are not joined to segments
+            object_hook (Callable | None): Passed to json.loads when parsing JSON output
+
+        Raises:
+            RuntimeError: An error is raised if CollateX fails.
+
+        Returns:
+            dict | str: CollateX output JSON, or the raw output for other formats
+        """
+        import urllib.error
+        import urllib.request
+
+        body = json.dumps({**input_json, "joined": not tokenized}, ensure_ascii=False).encode("UTF-8")
+
+        for attempt in range(2):
+            self.start()
+            request = urllib.request.Request(
+                self.url,
+                data=body,
+                headers={
+                    "Content-Type": "application/json; charset=UTF-8",
+                    "Accept": ACCEPT_HEADERS[output_format],
+                },
+                method="POST",
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=self.request_timeout) as response:  # noqa: S310
+                    out = response.read()
+                break
+            except urllib.error.HTTPError as err:
+                error = f"CollateX failed: {err.code} {err.read()}"
+                raise RuntimeError(error) from err
+            except (urllib.error.URLError, ConnectionError) as err:
+                # The JVM died mid-request; restart it once before giving up.
+                if attempt == 1 or self.is_running():
+                    error = f"CollateX server unreachable: {err}"
+                    raise RuntimeError(error) from err
+                self.stop()
+
+        if output_format == "json":
+            return json.loads(out, object_hook=object_hook)
+        return out.decode("UTF-8")
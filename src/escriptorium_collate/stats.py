@@ -0,0 +1,185 @@
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from typing import Dict
+except ImportError:
+    from typing_extensions import Dict
+
+
+class _InstrumentedConnector:
+    """
+    Proxy of an EscriptoriumConnector that records the count and latency of every method call.
+    """
+
+    def __init__(self, escr, stats: "CollationStats"):
+        self._escr = escr
+        self._stats = stats
+
+    def __getattr__(self, name):
+        attr = getattr(self._escr, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._stats.add_request(name, time.perf_counter() - start)
+
+        return call
+
+
+class CollationStats:
+    """
+    Opt-in instrumentation of the collation pipeline.
+
+    Pass an instance as `stats` to `collate`, `get_collatex_input` or
+    `get_collatex_output` to record the duration of each stage, the number and
+    latency of requests to each eScriptorium endpoint, the number of tokens of
+    each witness, the peak RSS of CollateX subprocesses and the size of the output.
+    Stages that run on several threads at once (e.g. "tokenize" and "align")
+    add up the time spent on every thread.
+    """
+
+    def __init__(self, *, profile: bool = False):
+        """
+        Args:
+            profile (bool): If true, the pipeline also runs under cProfile
+                (see dump_profile and get_profile_text)
+        """
+        self.stages: Dict[str, float] = {}
+        self.requests: Dict[str, dict] = {}
+        self.tokens: Dict[str, int] = {}
+        self.subprocess_max_rss: int | None = None
+        self.output_columns: int | None = None
+        self.output_chars: int | None = None
+        self.profiler = cProfile.Profile() if profile else None
+        self._lock = threading.Lock()
+        self._connectors: Dict[int, _InstrumentedConnector] = {}
+        self._profiling = 0
+
+    def add_stage(self, name: str, duration: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + duration
+
+    def add_request(self, endpoint: str, duration: float):
+        with self._lock:
+            request = self.requests.setdefault(endpoint, {"count": 0, "total_time": 0.0, "max_time": 0.0})
+            request["count"] += 1
+            request["total_time"] += duration
+            request["max_time"] = max(request["max_time"], duration)
+
+    def record_subprocess(self):
+        """
+        Record the peak RSS of the largest subprocess waited for so far.
+        """
+        if resource is None:
+            return
+        # ru_maxrss is in kilobytes on Linux.
+        rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        with self._lock:
+            self.subprocess_max_rss = max(self.subprocess_max_rss or 0, rss)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Context manager adding the time spent in its body to a given stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def profiling(self):
+        """
+        Context manager running its body under cProfile, if profiling is enabled.
+        Nested uses profile the outermost body only.
+        """
+        if self.profiler is None:
+            yield
+            return
+        with self._lock:
+            self._profiling += 1
+            if self._profiling == 1:
+                self.profiler.enable()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._profiling -= 1
+                if self._profiling == 0:
+                    self.profiler.disable()
+
+    def instrument(self, escr):
+        """
+        Return a proxy of a connector that records every request in these stats.
+        The same proxy is returned for the same connector.
+        """
+        if isinstance(escr, _InstrumentedConnector):
+            return escr
+        with self._lock:
+            connector = self._connectors.get(id(escr))
+            if connector is None or connector._escr is not escr:
+                connector = _InstrumentedConnector(escr, self)
+                self._connectors[id(escr)] = connector
+            return connector
+
+    def to_dict(self) -> dict:
+        """
+        Return the recorded statistics as a JSON-serializable dict.
+        """
+        with self._lock:
+            return {
+                "stages": dict(self.stages),
+                "requests": {endpoint: dict(request) for endpoint, request in self.requests.items()},
+                "tokens": dict(self.tokens),
+                "subprocess_max_rss": self.subprocess_max_rss,
+                "output_columns": self.output_columns,
+                "output_chars": self.output_chars,
+            }
+
+    def to_json(self, **kwargs) -> str:
+        """
+        Return the recorded statistics as JSON; keyword arguments are passed to json.dumps.
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def dump_profile(self, path: str):
+        """
+        Write the cProfile data in pstats format, e.g. for snakeviz.
+        """
+        self.profiler.dump_stats(path)
+
+    def get_profile_text(self, sort: str = "cumulative", limit: int = 30) -> str:
+        """
+        Return the most expensive functions of the cProfile data as text.
+        """
+        import pstats
+
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+def stage(stats: CollationStats | None, name: str):
+    """
+    Return a context manager timing a stage in stats, or doing nothing if stats is None.
+    """
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.stage(name)
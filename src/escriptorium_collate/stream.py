@@ -0,0 +1,138 @@
+import json
+
+try:
+    from typing import Callable, Dict, Iterator, List, NamedTuple, TextIO
+except ImportError:
+    from typing_extensions import Callable, Dict, Iterator, List, NamedTuple, TextIO
+
+from escriptorium_collate.tokens import EMPTY_TOKEN
+
+
+class AlignmentColumn(NamedTuple):
+    """
+    One column of the CollateX alignment table: its index, and the cell of every
+    witness by siglum, each holding the tokens of that witness aligned to the column.
+    """
+
+    index: int
+    cells: Dict[str, List[dict]]
+
+
+def restore_empty_token(obj: dict) -> dict:
+    """
+    JSON object hook turning the placeholder " " values of tokens back into
+    empty strings while CollateX output is parsed.
+    """
+    for key in ("n", "t"):
+        if obj.get(key) == EMPTY_TOKEN:
+            obj[key] = ""
+    return obj
+
+
+class CollatexOutputReader:
+    """
+    Incremental reader of CollateX JSON output.
+
+    Iterating over the reader yields the columns of the alignment table one by one
+    while the output is still being read, so that the full output never has to
+    be held in memory as text. Other top-level values (such as `witnesses`) are
+    stored as attributes when they are encountered, and the number of characters
+    read so far as `chars_read`.
+    """
+
+    def __init__(
+        self,
+        stream: TextIO,
+        chunk_size: int = 1 << 16,
+        object_hook: Callable[[dict], object] | None = None,
+    ):
+        """
+        Args:
+            stream (TextIO): A text stream of CollateX JSON output
+            chunk_size (int): Number of characters to read at once
+            object_hook (Callable | None): Called with every JSON object as it is
+                decoded, e.g. restore_empty_token
+        """
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.witnesses: list | None = None
+        self.extra: dict = {}
+        self.chars_read = 0
+        self._decoder = json.JSONDecoder(object_hook=object_hook)
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size: int) -> bool:
+        if self._eof:
+            return False
+        chunk = self.stream.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+        self.chars_read += len(chunk)
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill(self.chunk_size):
+                error = "Unexpected end of CollateX output"
+                raise ValueError(error)
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            error = f"Expected {char!r} in CollateX output, found {self._buffer[self._pos]!r}"
+            raise ValueError(error)
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # The value is incomplete: read at least as much again as is
+                # buffered, so that large values are decoded a bounded number of times.
+                if not self._fill(max(self.chunk_size, len(self._buffer) - self._pos)):
+                    raise
+                continue
+            if end == len(self._buffer) and not isinstance(value, (dict, list, str)) and self._fill(self.chunk_size):
+                # A number or literal may continue in the next chunk.
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self) -> Iterator[list]:
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "table":
+                self._expect("[")
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._peek() == ",":
+                            self._pos += 1
+                            continue
+                        self._expect("]")
+                        break
+            elif key == "witnesses":
+                self.witnesses = self._value()
+            else:
+                self.extra[key] = self._value()
+            if self._peek() == ",":
+                self._pos += 1
+                continue
+            self._expect("}")
+            return
@@ -0,0 +1,157 @@
+import sys
+from array import array
+
+try:
+    from typing import List
+except ImportError:
+    from typing_extensions import List
+
+# CollateX rejects empty tokens, so they are replaced with this placeholder.
+EMPTY_TOKEN = " "
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into tokens at runs of whitespace, as nltk's WhitespaceTokenizer does.
+    """
+    return text.split()
+
+
+class WitnessTokens:
+    """
+    Compact, columnar store of the CollateX tokens of a witness.
+
+    Token values are kept in parallel lists (interned, so that repeated words
+    share one string) and primary keys in parallel integer arrays, with 0
+    standing for None. The document and transcription layer primary keys are
+    stored once for the whole witness. Empty token values are replaced with
+    the EMPTY_TOKEN placeholder as they are appended. Tokens are only turned
+    into CollateX token dicts by to_json.
+    """
+
+    __slots__ = (
+        "doc_pk",
+        "normalized_transcription_pk",
+        "diplomatic_transcription_pk",
+        "t",
+        "n",
+        "line_pk",
+        "normalized_line_transcription_pk",
+        "diplomatic_line_transcription_pk",
+    )
+
+    def __init__(
+        self,
+        doc_pk: int,
+        normalized_transcription_pk: int | None = None,
+        diplomatic_transcription_pk: int | None = None,
+    ):
+        """
+        Args:
+            doc_pk (int): Primary key of the eScriptorium document
+            normalized_transcription_pk (int | None): Primary key of the normalized transcription layer
+            diplomatic_transcription_pk (int | None): Primary key of the diplomatic transcription layer
+        """
+        self.doc_pk = doc_pk
+        self.normalized_transcription_pk = normalized_transcription_pk
+        self.diplomatic_transcription_pk = diplomatic_transcription_pk
+        self.t: List[str] = []
+        self.n: List[str | None] = []
+        self.line_pk = array("q")
+        self.normalized_line_transcription_pk = array("q")
+        self.diplomatic_line_transcription_pk = array("q")
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def append(
+        self,
+        t: str,
+        n: str | None,
+        line_pk: int,
+        normalized_line_transcription_pk: int | None,
+        diplomatic_line_transcription_pk: int | None,
+    ):
+        """
+        Append a token. If n is None, the token has no separate normalized value.
+        """
+        self.t.append(sys.intern(t or EMPTY_TOKEN))
+        self.n.append(None if n is None else sys.intern(n or EMPTY_TOKEN))
+        self.line_pk.append(line_pk)
+        self.normalized_line_transcription_pk.append(normalized_line_transcription_pk or 0)
+        self.diplomatic_line_transcription_pk.append(diplomatic_line_transcription_pk or 0)
+
+    def extend(self, other: "WitnessTokens"):
+        """
+        Append the tokens of another WitnessTokens instance of the same witness,
+        e.g. those of the next part. Transcription layer primary keys that are
+        not yet known are taken from the other instance.
+        """
+        if self.normalized_transcription_pk is None:
+            self.normalized_transcription_pk = other.normalized_transcription_pk
+        if self.diplomatic_transcription_pk is None:
+            self.diplomatic_transcription_pk = other.diplomatic_transcription_pk
+        self.t.extend(other.t)
+        self.n.extend(other.n)
+        self.line_pk.extend(other.line_pk)
+        self.normalized_line_transcription_pk.extend(other.normalized_line_transcription_pk)
+        self.diplomatic_line_transcription_pk.extend(other.diplomatic_line_transcription_pk)
+
+    def to_json(self) -> List[dict]:
+        """
+        Return the tokens as CollateX token dicts.
+
+        Returns:
+            List[dict]: CollateX tokens
+        """
+        tokens = []
+        for t, n, line_pk, normalized_line_pk, diplomatic_line_pk in zip(
+            self.t,
+            self.n,
+            self.line_pk,
+            self.normalized_line_transcription_pk,
+            self.diplomatic_line_transcription_pk,
+        ):
+            token = {"t": t}
+            if n is not None:
+                token["n"] = n
+            token["doc_pk"] = self.doc_pk
+            token["line_pk"] = line_pk
+            token["normalized_transcription_pk"] = self.normalized_transcription_pk if normalized_line_pk else None
+            token["normalized_line_transcription_pk"] = normalized_line_pk or None
+            token["diplomatic_transcription_pk"] = self.diplomatic_transcription_pk if diplomatic_line_pk else None
+            token["diplomatic_line_transcription_pk"] = diplomatic_line_pk or None
+            tokens.append(token)
+        return tokens
+
+    def to_columns(self) -> dict:
+        """
+        Return a JSON-serializable columnar representation, e.g. for caching.
+        """
+        return {
+            "doc_pk": self.doc_pk,
+            "normalized_transcription_pk": self.normalized_transcription_pk,
+            "diplomatic_transcription_pk": self.diplomatic_transcription_pk,
+            "t": self.t,
+            "n": self.n,
+            "line_pk": self.line_pk.tolist(),
+            "normalized_line_transcription_pk": self.normalized_line_transcription_pk.tolist(),
+            "diplomatic_line_transcription_pk": self.diplomatic_line_transcription_pk.tolist(),
+        }
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> "WitnessTokens":
+        """
+        Rebuild a WitnessTokens instance from the output of to_columns.
+        """
+        tokens = cls(
+            doc_pk=columns["doc_pk"],
+            normalized_transcription_pk=columns["normalized_transcription_pk"],
+            diplomatic_transcription_pk=columns["diplomatic_transcription_pk"],
+        )
+        tokens.t = [sys.intern(t) for t in columns["t"]]
+        tokens.n = [None if n is None else sys.intern(n) for n in columns["n"]]
+        tokens.line_pk = array("q", columns["line_pk"])
+        tokens.normalized_line_transcription_pk = array("q", columns["normalized_line_transcription_pk"])
+        tokens.diplomatic_line_transcription_pk = array("q", columns["diplomatic_line_transcription_pk"])
+        return tokens
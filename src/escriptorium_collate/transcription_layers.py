@@ -1,13 +1,165 @@
-from escriptorium_connector import EscriptoriumConnector
-from escriptorium_connector.dtos import (
-    PostAbbreviatedTranscription,
-    PostTranscription,
-    PutTranscription,
-)
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
+except ImportError:
+    from typing_extensions import TYPE_CHECKING, Callable, Dict, List, Tuple
+
+from escriptorium_collate.fetch import get_part_line_transcriptions, with_retry
+from escriptorium_collate.stats import _InstrumentedConnector
+
+if TYPE_CHECKING:
+    from escriptorium_connector import EscriptoriumConnector
+    from escriptorium_connector.dtos import GetAbbreviatedTranscription
+
+
+class LayerRegistry:
+    """
+    Memoized index of the transcription layers of eScriptorium documents.
+
+    The layers of a document are loaded with one request the first time they are
+    needed and indexed by name and by primary key. Entries are reloaded once they
+    are older than ttl seconds, or after invalidate is called.
+    """
+
+    def __init__(self, escr: "EscriptoriumConnector", ttl: float | None = None):
+        """
+        Args:
+            escr (EscriptoriumConnector): An EscriptoriumConnector instance
+            ttl (float | None): If set, the layers of a document are reloaded
+                once they were loaded more than this many seconds ago
+        """
+        self.escr = escr
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._layers: Dict[int, tuple] = {}
+
+    def _get(self, doc_pk: int, *, reload: bool = False) -> tuple:
+        with self._lock:
+            entry = self._layers.get(doc_pk)
+        if entry is not None and not reload and (self.ttl is None or time.monotonic() - entry[0] <= self.ttl):
+            return entry
+        transcriptions = with_retry(self.escr.get_document_transcriptions, doc_pk=doc_pk)
+        entry = (
+            time.monotonic(),
+            {transcription.name: transcription for transcription in transcriptions},
+            {transcription.pk: transcription for transcription in transcriptions},
+        )
+        with self._lock:
+            self._layers[doc_pk] = entry
+        return entry
+
+    def _with_connector(self, escr: "EscriptoriumConnector") -> "LayerRegistry":
+        # A view sharing the entries of the registry, which sends its requests through another connector.
+        registry = LayerRegistry(escr, ttl=self.ttl)
+        registry._lock = self._lock
+        registry._layers = self._layers
+        return registry
+
+    def load(self, doc_pks: List[int], max_workers: int = 1):
+        """
+        Load the layers of many documents at once, skipping those already loaded.
+
+        Args:
+            doc_pks (List[int]): Primary keys of eScriptorium documents
+            max_workers (int): Maximum number of requests to eScriptorium in flight at once
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self._get, set(doc_pks)))
+
+    def get_layers(self, doc_pk: int) -> List["GetAbbreviatedTranscription"]:
+        """
+        Return the transcription layers of a document.
+        """
+        return list(self._get(doc_pk)[2].values())
+
+    def get_pk_by_name(self, doc_pk: int, transcription_name: str) -> int:
+        """
+        Return the primary key of the transcription layer with a given name.
+        If no layer matches, the layers of the document are reloaded once.
+
+        Raises:
+            ValueError: If no transcription layer with the given name is found
+        """
+        layer = self._get(doc_pk)[1].get(transcription_name)
+        if layer is None:
+            layer = self._get(doc_pk, reload=True)[1].get(transcription_name)
+        if layer is None:
+            error = "No transcription layer matches provided name"
+            raise ValueError(error)
+        return layer.pk
+
+    def get_layer(self, doc_pk: int, transcription_pk: int) -> "GetAbbreviatedTranscription":
+        """
+        Return the transcription layer with a given primary key.
+        If no layer matches, the layers of the document are reloaded once.
+
+        Raises:
+            ValueError: If no transcription layer with the given primary key is found
+        """
+        layer = self._get(doc_pk)[2].get(transcription_pk)
+        if layer is None:
+            layer = self._get(doc_pk, reload=True)[2].get(transcription_pk)
+        if layer is None:
+            error = "No transcription layer matches provided primary key"
+            raise ValueError(error)
+        return layer
+
+    def add(self, doc_pk: int, transcription: "GetAbbreviatedTranscription"):
+        """
+        Record a newly created transcription layer, if the layers of its document are loaded.
+        """
+        with self._lock:
+            entry = self._layers.get(doc_pk)
+            if entry is not None:
+                entry[1][transcription.name] = transcription
+                entry[2][transcription.pk] = transcription
+
+    def invalidate(self, doc_pk: int | None = None):
+        """
+        Forget the layers of a given document, or of every document if doc_pk is omitted.
+        """
+        with self._lock:
+            if doc_pk is None:
+                self._layers.clear()
+            else:
+                self._layers.pop(doc_pk, None)
+
+
+_registries: "weakref.WeakKeyDictionary[EscriptoriumConnector, LayerRegistry]" = weakref.WeakKeyDictionary()
+_registries_lock = threading.Lock()
+
+
+def get_layer_registry(escr: "EscriptoriumConnector") -> LayerRegistry:
+    """
+    Return the LayerRegistry shared by every caller using a given connector.
+
+    A connector instrumented by CollationStats shares the registry of the connector
+    it wraps, while the requests of the returned registry still go through it
+    and are counted.
+
+    Args:
+        escr (EscriptoriumConnector): An EscriptoriumConnector instance
+
+    Returns:
+        LayerRegistry: The registry of the connector
+    """
+    connector = escr._escr if isinstance(escr, _InstrumentedConnector) else escr
+    with _registries_lock:
+        registry = _registries.get(connector)
+        if registry is None:
+            registry = LayerRegistry(connector)
+            _registries[connector] = registry
+    if connector is not escr:
+        return registry._with_connector(escr)
+    return registry
 
 
 def create(
-    escr: EscriptoriumConnector,
+    escr: "EscriptoriumConnector",
     doc_pk: int,
     layer_name: str,
 ):
@@ -20,10 +172,13 @@ def create(
         doc_pk (int): Primary key of an eScriptorium document
         layer_name (str): Name of the transcription layer to be created
     """
+    from escriptorium_connector.dtos import PostAbbreviatedTranscription, PostTranscription
+
     transcription = escr.create_document_transcription(
         doc_pk=doc_pk,
         transcription_name=PostAbbreviatedTranscription(layer_name),
     )
+    get_layer_registry(escr).add(doc_pk, transcription)
     parts = escr.get_document_parts(doc_pk=doc_pk).results
     for part in parts:
         lines = escr.get_document_part_lines(
@@ -44,17 +199,32 @@ def create(
         )
 
 
+def _send_in_batches(send, doc_pk: int, part_pk: int, transcriptions: list, batch_size: int):
+    for start in range(0, len(transcriptions), batch_size):
+        with_retry(
+            send,
+            doc_pk=doc_pk,
+            part_pk=part_pk,
+            transcriptions=transcriptions[start : start + batch_size],
+        )
+
+
 def copy(
-    escr: EscriptoriumConnector,
+    escr: "EscriptoriumConnector",
     doc_pk: int,
     source_transcription_layer_name: str,
     target_transcription_layer_name: str,
     overwrite: bool,
-):
+    batch_size: int = 100,
+) -> int:
     """
     Copy the content of one transcription layer
     to another for a given eScriptorium document.
 
+    The line transcriptions of both layers are fetched in bulk, one call per part,
+    and only the lines whose target content differs from the source are written.
+    Lines missing from the target layer are only created if the source line has content.
+
     Args:
         escr (EscriptoriumConnector):
             An EscriptoriumConnector instance
@@ -66,7 +236,13 @@ def copy(
             Name of the transcription layer to be written
         overwrite (bool):
             If true, content of the target transcription layer is overwritten
+        batch_size (int):
+            Maximum number of lines sent to eScriptorium in one bulk request
+
+    Returns:
+        int: Number of line transcriptions written
     """
+    from escriptorium_connector.dtos import PostTranscription, PutTranscription
 
     source_transcription_layer_pk = get_transcription_pk_by_name(
         escr=escr,
@@ -80,29 +256,25 @@ def copy(
         transcription_name=target_transcription_layer_name,
     )
 
-    parts = escr.get_document_parts(doc_pk=doc_pk).results
+    written = 0
+    parts = with_retry(escr.get_document_parts, doc_pk=doc_pk).results
     for part in parts:
-        lines = escr.get_document_part_lines(
+        lines = with_retry(
+            escr.get_document_part_lines,
             doc_pk=doc_pk,
             part_pk=part.pk,
         ).results
+        line_transcriptions = get_part_line_transcriptions(escr=escr, doc_pk=doc_pk, part_pk=part.pk)
         update_transcriptions = []
         create_transcriptions = []
         for line in lines:
-            source_transcription = escr.get_document_part_line_transcription_by_transcription(
-                doc_pk=doc_pk,
-                part_pk=part.pk,
-                line_pk=line.pk,
-                transcription_pk=source_transcription_layer_pk,
-            )
-            target_transcription = escr.get_document_part_line_transcription_by_transcription(
-                doc_pk=doc_pk,
-                part_pk=part.pk,
-                line_pk=line.pk,
-                transcription_pk=target_transcription_layer_pk,
-            )
+            source_transcription = line_transcriptions.get(line.pk, {}).get(source_transcription_layer_pk)
+            target_transcription = line_transcriptions.get(line.pk, {}).get(target_transcription_layer_pk)
+            content = source_transcription.content if source_transcription else ""
             if target_transcription:
-                if target_transcription.content and not overwrite:
+                if target_transcription.content == content:
+                    pass
+                elif target_transcription.content and not overwrite:
                     pass
                 else:
                     update_transcriptions.append(
@@ -110,31 +282,337 @@ def copy(
                             line=line.pk,
                             pk=target_transcription.pk,
                             transcription=target_transcription_layer_pk,
-                            content=source_transcription.content if source_transcription else "",
+                            content=content,
                         )
                     )
-            else:
+            elif content:
                 create_transcriptions.append(
                     PostTranscription(
                         line=line.pk,
                         transcription=target_transcription_layer_pk,
-                        content=source_transcription.content if source_transcription else "",
+                        content=content,
                     )
                 )
-        escr.bulk_update_transcriptions(
-            doc_pk=doc_pk,
-            part_pk=part.pk,
-            transcriptions=update_transcriptions,
+        _send_in_batches(escr.bulk_update_transcriptions, doc_pk, part.pk, update_transcriptions, batch_size)
+        _send_in_batches(escr.bulk_create_transcriptions, doc_pk, part.pk, create_transcriptions, batch_size)
+        written += len(update_transcriptions) + len(create_transcriptions)
+
+    return written
+
+
+def copy_many(
+    escr: "EscriptoriumConnector",
+    doc_pks: List[int],
+    source_transcription_layer_name: str,
+    target_transcription_layer_name: str,
+    *,
+    overwrite: bool,
+    batch_size: int = 100,
+    max_workers: int = 4,
+) -> Dict[int, int]:
+    """
+    Copy the content of one transcription layer to another
+    for many eScriptorium documents, processing documents concurrently.
+
+    Args:
+        escr (EscriptoriumConnector):
+            An EscriptoriumConnector instance
+        doc_pks (List[int]):
+            Primary keys of eScriptorium documents
+        source_transcription_layer_name (str):
+            Name of the transcription layer to be copied
+        target_transcription_layer_name (str):
+            Name of the transcription layer to be written
+        overwrite (bool):
+            If true, content of the target transcription layer is overwritten
+        batch_size (int):
+            Maximum number of lines sent to eScriptorium in one bulk request
+        max_workers (int):
+            Maximum number of documents processed at once
+
+    Returns:
+        dict: Number of line transcriptions written, keyed by document primary key
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        written = executor.map(
+            lambda doc_pk: copy(
+                escr=escr,
+                doc_pk=doc_pk,
+                source_transcription_layer_name=source_transcription_layer_name,
+                target_transcription_layer_name=target_transcription_layer_name,
+                overwrite=overwrite,
+                batch_size=batch_size,
+            ),
+            doc_pks,
         )
-        escr.bulk_create_transcriptions(
+        return dict(zip(doc_pks, written))
+
+
+def get_line_contents(
+    collatex_output: dict,
+    render: Callable[[dict, int], str] | None = None,
+    gap: str | None = None,
+) -> Dict[int, Dict[int, str]]:
+    """
+    Group the tokens of a collation by the eScriptorium line they come from
+    and join them into line contents.
+
+    Args:
+        collatex_output (dict): CollateX output JSON, e.g. returned by collate
+        render (Callable | None): Called with every token and the index of its column,
+            returns the text written for the token; defaults to the token's "t" value.
+            Tokens rendered as empty strings are left out.
+        gap (str | None): If set, written for every empty cell of a witness,
+            in the line of the witness's preceding token (or following token,
+            before the first token)
+
+    Returns:
+        dict: Line contents keyed as {doc_pk: {line_pk: content}}
+    """
+    contents: Dict[int, Dict[int, List[str]]] = {}
+    table = collatex_output["table"]
+    for witness_index in range(len(collatex_output["witnesses"])):
+        line_words = None
+        pending_gaps = []
+        for column_index, column in enumerate(table):
+            cell = column[witness_index]
+            if not cell:
+                if gap is None:
+                    pass
+                elif line_words is None:
+                    pending_gaps.append(gap)
+                else:
+                    line_words.append(gap)
+                continue
+            for token in cell:
+                line_words = contents.setdefault(token["doc_pk"], {}).setdefault(token["line_pk"], [])
+                if pending_gaps:
+                    line_words.extend(pending_gaps)
+                    pending_gaps = []
+                word = token["t"] if render is None else render(token, column_index)
+                if word:
+                    line_words.append(word)
+    return {
+        doc_pk: {line_pk: " ".join(words) for line_pk, words in lines.items()} for doc_pk, lines in contents.items()
+    }
+
+
+def _create_idempotently(escr: "EscriptoriumConnector", doc_pk: int, part_pk: int, transcriptions: list):
+    attempts = 0
+
+    def send():
+        nonlocal attempts
+        pending = transcriptions
+        if attempts:
+            # A failed request may still have been applied: only create what is still missing.
+            existing = get_part_line_transcriptions(escr=escr, doc_pk=doc_pk, part_pk=part_pk)
+            pending = [
+                transcription
+                for transcription in transcriptions
+                if transcription.transcription not in existing.get(transcription.line, {})
+            ]
+        attempts += 1
+        if pending:
+            escr.bulk_create_transcriptions(doc_pk=doc_pk, part_pk=part_pk, transcriptions=pending)
+
+    with_retry(send)
+
+
+def _get_part_writer(
+    escr: "EscriptoriumConnector",
+    doc_pk: int,
+    line_contents: Dict[int, str],
+    target_transcription_layer_name: str,
+    *,
+    overwrite: bool,
+    batch_size: int,
+) -> Tuple[Callable[[int], int], List[int]]:
+    """
+    Resolve the target layer of a document, creating it if it does not exist yet,
+    and list the document's parts. Return a function writing the line contents of
+    one part and returning the number of line transcriptions written, together
+    with the primary keys of the parts.
+    """
+    from escriptorium_connector.dtos import PostAbbreviatedTranscription, PostTranscription, PutTranscription
+
+    registry = get_layer_registry(escr)
+    try:
+        target_transcription_layer_pk = registry.get_pk_by_name(
+            doc_pk=doc_pk, transcription_name=target_transcription_layer_name
+        )
+    except ValueError:
+        transcription = escr.create_document_transcription(
             doc_pk=doc_pk,
-            part_pk=part.pk,
-            transcriptions=create_transcriptions,
+            transcription_name=PostAbbreviatedTranscription(target_transcription_layer_name),
+        )
+        registry.add(doc_pk, transcription)
+        target_transcription_layer_pk = transcription.pk
+
+    def write_part(part_pk: int) -> int:
+        # Every line with tokens has a line transcription, so the part's line
+        # transcriptions tell which of the lines to be written belong to it.
+        line_transcriptions = get_part_line_transcriptions(escr=escr, doc_pk=doc_pk, part_pk=part_pk)
+        update_transcriptions = []
+        create_transcriptions = []
+        for line_pk, layers in line_transcriptions.items():
+            content = line_contents.get(line_pk)
+            if content is None:
+                continue
+            target_transcription = layers.get(target_transcription_layer_pk)
+            if target_transcription:
+                if target_transcription.content == content:
+                    pass
+                elif target_transcription.content and not overwrite:
+                    pass
+                else:
+                    update_transcriptions.append(
+                        PutTranscription(
+                            line=line_pk,
+                            pk=target_transcription.pk,
+                            transcription=target_transcription_layer_pk,
+                            content=content,
+                        )
+                    )
+            elif content:
+                create_transcriptions.append(
+                    PostTranscription(
+                        line=line_pk,
+                        transcription=target_transcription_layer_pk,
+                        content=content,
+                    )
+                )
+        _send_in_batches(escr.bulk_update_transcriptions, doc_pk, part_pk, update_transcriptions, batch_size)
+        for start in range(0, len(create_transcriptions), batch_size):
+            _create_idempotently(escr, doc_pk, part_pk, create_transcriptions[start : start + batch_size])
+        return len(update_transcriptions) + len(create_transcriptions)
+
+    parts = with_retry(escr.get_document_parts, doc_pk=doc_pk).results
+    return write_part, [part.pk for part in parts]
+
+
+def write_lines(
+    escr: "EscriptoriumConnector",
+    doc_pk: int,
+    line_contents: Dict[int, str],
+    target_transcription_layer_name: str,
+    *,
+    overwrite: bool = True,
+    batch_size: int = 100,
+    max_workers: int = 4,
+) -> int:
+    """
+    Write line contents into a transcription layer of an eScriptorium document.
+
+    The target layer is created if it does not exist yet. The line transcriptions
+    of every part are fetched in bulk, and only the lines whose target content
+    differs are written, with bulk requests of at most batch_size lines. Parts are
+    processed concurrently. Retried bulk creations first check which lines were
+    already created, so a request that failed after being applied does not
+    create duplicates.
+
+    Args:
+        escr (EscriptoriumConnector):
+            An EscriptoriumConnector instance
+        doc_pk (int):
+            Primary key of an eScriptorium document
+        line_contents (dict):
+            Content to be written, keyed by line primary key
+        target_transcription_layer_name (str):
+            Name of the transcription layer to be written
+        overwrite (bool):
+            If true, non-empty content of the target transcription layer is overwritten
+        batch_size (int):
+            Maximum number of lines sent to eScriptorium in one bulk request
+        max_workers (int):
+            Maximum number of parts processed at once
+
+    Returns:
+        int: Number of line transcriptions written
+    """
+    write_part, part_pks = _get_part_writer(
+        escr=escr,
+        doc_pk=doc_pk,
+        line_contents=line_contents,
+        target_transcription_layer_name=target_transcription_layer_name,
+        overwrite=overwrite,
+        batch_size=batch_size,
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(write_part, part_pks))
+
+
+def write_back(
+    escr: "EscriptoriumConnector",
+    collatex_output: dict,
+    target_transcription_layer_name: str,
+    render: Callable[[dict, int], str] | None = None,
+    gap: str | None = None,
+    *,
+    overwrite: bool = True,
+    batch_size: int = 100,
+    max_workers: int = 4,
+) -> Dict[int, int]:
+    """
+    Write the output of a collation back into a transcription layer
+    of every collated eScriptorium document.
+
+    The tokens are grouped into lines by their provenance (see get_line_contents),
+    and each document is written like with write_lines, the parts of all
+    documents being processed concurrently on one pool of max_workers threads.
+    Writing a whole collation takes one request per document to list its parts,
+    one request per part to read its line transcriptions, and one bulk request
+    per batch_size changed lines.
+
+    Args:
+        escr (EscriptoriumConnector):
+            An EscriptoriumConnector instance
+        collatex_output (dict):
+            CollateX output JSON, e.g. returned by collate
+        target_transcription_layer_name (str):
+            Name of the transcription layer to be written, created if missing
+        render (Callable | None):
+            Called with every token and the index of its column,
+            returns the text written for the token; defaults to the token's "t" value
+        gap (str | None):
+            If set, written for every empty cell of a witness
+        overwrite (bool):
+            If true, non-empty content of the target transcription layer is overwritten
+        batch_size (int):
+            Maximum number of lines sent to eScriptorium in one bulk request
+        max_workers (int):
+            Maximum number of documents and parts processed at once, across all documents
+
+    Returns:
+        dict: Number of line transcriptions written, keyed by document primary key
+    """
+    contents = get_line_contents(collatex_output=collatex_output, render=render, gap=gap)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        writers = list(
+            executor.map(
+                lambda doc_pk: _get_part_writer(
+                    escr=escr,
+                    doc_pk=doc_pk,
+                    line_contents=contents[doc_pk],
+                    target_transcription_layer_name=target_transcription_layer_name,
+                    overwrite=overwrite,
+                    batch_size=batch_size,
+                ),
+                list(contents),
+            )
         )
+        jobs = [
+            (doc_pk, write_part, part_pk)
+            for doc_pk, (write_part, part_pks) in zip(contents, writers)
+            for part_pk in part_pks
+        ]
+        written = dict.fromkeys(contents, 0)
+        for (doc_pk, _, _), count in zip(jobs, executor.map(lambda job: job[1](job[2]), jobs)):
+            written[doc_pk] += count
+        return written
 
 
 def get_transcription_pk_by_name(
-    escr: EscriptoriumConnector,
+    escr: "EscriptoriumConnector",
     doc_pk: int,
     transcription_name: str,
 ):
@@ -142,6 +620,9 @@ def get_transcription_pk_by_name(
     Given the name of a transcription layer within a given document,
     return the transcription layer's primary key.
 
+    The layers of the document are loaded once and memoized in the
+    connector's LayerRegistry (see get_layer_registry).
+
     Args:
         escr (EscriptoriumConnector): An EscriptoriumConnector instance
         doc_pk (int): Primary key of an eScriptorium document
@@ -154,8 +635,4 @@ def get_transcription_pk_by_name(
     Returns:
         int: Primary key of the transcription layer
     """
-    transcriptions = escr.get_document_transcriptions(doc_pk=doc_pk)
-    for t in transcriptions:
-        if t.name == transcription_name:
-            return t.pk
-    raise ValueError("No transcription layer matches provided name")
+    return get_layer_registry(escr).get_pk_by_name(doc_pk=doc_pk, transcription_name=transcription_name)
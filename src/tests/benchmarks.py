@@ -0,0 +1,206 @@
+# SPDX-FileCopyrightText: 2023-present oeshera <osama.eshera@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+"""
+Offline benchmarks of the collation pipeline against a simulated eScriptorium.
+
+Run from the src directory:
+
+    python -m tests.benchmarks --parts 1 10 50 --latency 0.01 --max-workers 8
+    python -m tests.benchmarks --import-time
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import escriptorium_collate
+from escriptorium_collate import transcription_layers
+from escriptorium_collate.collate import CollatexArgs, Witness, collate, get_collatex_input, get_collatex_output
+from tests.fake_escriptorium import FakeEscriptoriumConnector, make_documents
+
+
+def measure(escr, stage, func):
+    """
+    Run func and return its result together with a row of measurements.
+    """
+    requests = sum(escr.calls.values())
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    wall_time = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        "stage": stage,
+        "requests": sum(escr.calls.values()) - requests,
+        "wall_time": wall_time,
+        "peak_memory": peak,
+    }
+
+
+def run_benchmarks(
+    parts=(1, 10),
+    documents=3,
+    lines=20,
+    words=8,
+    drift=0.1,
+    latency=0.0,
+    max_workers=1,
+    engine="python",
+):
+    """
+    Benchmark every pipeline stage on synthetic corpora of increasing size.
+
+    Returns:
+        list: One dict of measurements per corpus size and stage
+    """
+    rows = []
+    collatex_args = CollatexArgs(engine=engine)
+    for part_count in parts:
+        corpus = make_documents(documents=documents, parts=part_count, lines=lines, words=words, drift=drift)
+        witnesses = [
+            Witness(
+                doc_pk=doc_pk,
+                siglum=str(doc_pk),
+                diplomatic_transcription_name="diplomatic",
+                normalized_transcription_name="normalized",
+            )
+            for doc_pk in corpus
+        ]
+        tokens = documents * part_count * lines * words
+
+        escr = FakeEscriptoriumConnector(corpus, latency=latency)
+        input_json, row = measure(
+            escr,
+            "get_collatex_input",
+            lambda: get_collatex_input(
+                escr=escr, witnesses=witnesses, collatex_args=collatex_args, max_workers=max_workers
+            ),
+        )
+        rows.append({"parts": part_count, "tokens": tokens, **row})
+
+        _, row = measure(
+            escr,
+            "get_collatex_output",
+            lambda: get_collatex_output(collatex_args=collatex_args, input_json=input_json),
+        )
+        rows.append({"parts": part_count, "tokens": tokens, **row})
+
+        escr = FakeEscriptoriumConnector(corpus, latency=latency)
+        _, row = measure(
+            escr,
+            "collate",
+            lambda: collate(escr=escr, witnesses=witnesses, collatex_args=collatex_args, max_workers=max_workers),
+        )
+        rows.append({"parts": part_count, "tokens": tokens, **row})
+
+        _, row = measure(
+            escr,
+            "transcription_layers.copy",
+            lambda: transcription_layers.copy_many(
+                escr=escr,
+                doc_pks=list(corpus),
+                source_transcription_layer_name="diplomatic",
+                target_transcription_layer_name="copy",
+                overwrite=True,
+                max_workers=max_workers,
+            ),
+        )
+        rows.append({"parts": part_count, "tokens": tokens, **row})
+
+    for row in rows:
+        row["tokens_per_second"] = row["tokens"] / row["wall_time"] if row["wall_time"] else float("inf")
+    return rows
+
+
+def measure_import_time(
+    modules=("escriptorium_collate.collate", "escriptorium_collate.transcription_layers", "escriptorium_collate.batch"),
+    runs=5,
+):
+    """
+    Import each module in fresh interpreters and measure the cold start.
+
+    Returns:
+        list: One dict per module with the median time of the import itself and of
+            the whole interpreter run, and the heavy dependencies loaded by the import
+    """
+    # Make the package importable in the child interpreters, installed or not.
+    path = os.path.dirname(os.path.dirname(escriptorium_collate.__file__))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [path, os.environ.get("PYTHONPATH")]))}
+    rows = []
+    for module in modules:
+        code = (
+            "import sys, time; start = time.perf_counter(); "
+            f"import {module}; "
+            "print(time.perf_counter() - start); "
+            "print(' '.join(m for m in ('numpy', 'nltk', 'escriptorium_connector', 'requests') if m in sys.modules))"
+        )
+        import_times = []
+        startup_times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env
+            ).stdout.splitlines()
+            startup_times.append(time.perf_counter() - start)
+            import_times.append(float(output[0]))
+        rows.append(
+            {
+                "module": module,
+                "import_time": statistics.median(import_times),
+                "startup_time": statistics.median(startup_times),
+                "heavy_modules": output[1].split() if len(output) > 1 else [],
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--parts", type=int, nargs="+", default=[1, 10, 50], help="Parts per document, one run each")
+    parser.add_argument("--documents", type=int, default=3, help="Number of witnesses")
+    parser.add_argument("--lines", type=int, default=20, help="Lines per part")
+    parser.add_argument("--words", type=int, default=8, help="Words per line")
+    parser.add_argument("--drift", type=float, default=0.1, help="Probability of a normalized token boundary drift")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per request")
+    parser.add_argument("--max-workers", type=int, default=1, help="Maximum number of requests in flight")
+    parser.add_argument("--engine", choices=["collatex", "python"], default="python", help="Collation engine")
+    parser.add_argument("--import-time", action="store_true", help="Only measure the import time of the package")
+    args = parser.parse_args()
+
+    if args.import_time:
+        sys.stdout.write(f"{'module':<42} {'import ms':>10} {'startup ms':>11}  heavy modules loaded\n")
+        for row in measure_import_time():
+            sys.stdout.write(
+                f"{row['module']:<42} {row['import_time'] * 1000:>10.1f} {row['startup_time'] * 1000:>11.1f}  "
+                f"{' '.join(row['heavy_modules']) or '-'}\n"
+            )
+        return
+
+    rows = run_benchmarks(
+        parts=args.parts,
+        documents=args.documents,
+        lines=args.lines,
+        words=args.words,
+        drift=args.drift,
+        latency=args.latency,
+        max_workers=args.max_workers,
+        engine=args.engine,
+    )
+    sys.stdout.write(
+        f"{'parts':>6} {'tokens':>9} {'stage':<26} {'requests':>9} {'seconds':>9} {'peak MiB':>9} {'tokens/s':>11}\n"
+    )
+    for row in rows:
+        sys.stdout.write(
+            f"{row['parts']:>6} {row['tokens']:>9} {row['stage']:<26} {row['requests']:>9} "
+            f"{row['wall_time']:>9.3f} {row['peak_memory'] / 2**20:>9.1f} {row['tokens_per_second']:>11.0f}\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# SPDX-FileCopyrightText: 2023-present oeshera <osama.eshera@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+import random
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+
+class FakeEscriptoriumConnector:
+    """
+    In-memory stand-in for EscriptoriumConnector serving the endpoints
+    used by escriptorium_collate. Every call is counted by method name.
+
+    Documents are given as {doc_pk: {layer_name: [[line_content, ...], ...]}},
+    i.e. one list of lines per part for each transcription layer. If latency
+    is given, every call sleeps for that many seconds, as a network round trip would.
+    """
+
+    def __init__(self, documents, latency=0.0):
+        self.calls = Counter()
+        self.latency = latency
+        self._calls_lock = threading.Lock()
+        self._layers = {}
+        self._parts = {}
+        self._lines = {}
+        self._line_transcriptions = {}
+        pk = 0
+        for doc_pk, layers in documents.items():
+            self._layers[doc_pk] = []
+            for layer_name in layers:
+                pk += 1
+                self._layers[doc_pk].append(SimpleNamespace(pk=pk, name=layer_name))
+            self._parts[doc_pk] = []
+            part_count = max(len(parts) for parts in layers.values())
+            for part_index in range(part_count):
+                pk += 1
+                part = SimpleNamespace(pk=pk, order=part_index)
+                self._parts[doc_pk].append(part)
+                self._lines[part.pk] = []
+                self._line_transcriptions[part.pk] = []
+                line_count = max(len(parts[part_index]) for parts in layers.values() if part_index < len(parts))
+                for line_index in range(line_count):
+                    pk += 1
+                    line = SimpleNamespace(pk=pk, order=line_index)
+                    self._lines[part.pk].append(line)
+                    for layer in self._layers[doc_pk]:
+                        parts = layers[layer.name]
+                        if part_index < len(parts) and line_index < len(parts[part_index]):
+                            pk += 1
+                            self._line_transcriptions[part.pk].append(
+                                SimpleNamespace(
+                                    pk=pk,
+                                    line=line.pk,
+                                    transcription=layer.pk,
+                                    content=parts[part_index][line_index],
+                                )
+                            )
+        self._next_pk = pk + 1
+
+    def _request(self, name):
+        with self._calls_lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_document_transcriptions(self, doc_pk):
+        self._request("get_document_transcriptions")
+        return list(self._layers[doc_pk])
+
+    def create_document_transcription(self, doc_pk, transcription_name):
+        self._request("create_document_transcription")
+        with self._calls_lock:
+            layer = SimpleNamespace(pk=self._next_pk, name=transcription_name.name)
+            self._next_pk += 1
+        self._layers[doc_pk].append(layer)
+        return layer
+
+    def get_document_parts(self, doc_pk):
+        self._request("get_document_parts")
+        return SimpleNamespace(results=list(self._parts[doc_pk]))
+
+    def get_document_part_lines(self, doc_pk, part_pk):
+        self._request("get_document_part_lines")
+        return SimpleNamespace(results=list(self._lines[part_pk]))
+
+    def get_document_part_transcriptions(self, doc_pk, part_pk):
+        self._request("get_document_part_transcriptions")
+        return SimpleNamespace(results=list(self._line_transcriptions[part_pk]))
+
+    def get_document_part_line_transcription_by_transcription(self, doc_pk, part_pk, line_pk, transcription_pk):
+        self._request("get_document_part_line_transcription_by_transcription")
+        for line_transcription in self._line_transcriptions[part_pk]:
+            if line_transcription.line == line_pk and line_transcription.transcription == transcription_pk:
+                return line_transcription
+        return None
+
+    def bulk_update_transcriptions(self, doc_pk, part_pk, transcriptions):
+        self._request("bulk_update_transcriptions")
+        by_pk = {line_transcription.pk: line_transcription for line_transcription in self._line_transcriptions[part_pk]}
+        for transcription in transcriptions:
+            by_pk[transcription.pk].content = transcription.content
+
+    def bulk_create_transcriptions(self, doc_pk, part_pk, transcriptions):
+        self._request("bulk_create_transcriptions")
+        with self._calls_lock:
+            for transcription in transcriptions:
+                self._line_transcriptions[part_pk].append(
+                    SimpleNamespace(
+                        pk=self._next_pk,
+                        line=transcription.line,
+                        transcription=transcription.transcription,
+                        content=transcription.content,
+                    )
+                )
+                self._next_pk += 1
+
+
+def make_documents(documents=2, parts=2, lines=20, words=8, variation=0.1, drift=0.1, seed=0):
+    """
+    Generate synthetic documents for FakeEscriptoriumConnector.
+
+    Every document is a copy of the same base text in which each word is replaced
+    with probability `variation`. Each document has a "diplomatic" layer, a
+    "normalized" layer in which adjacent words are joined with probability `drift`
+    (so that its token boundaries differ from the diplomatic ones), and an empty
+    "copy" layer.
+    """
+    rng = random.Random(seed)
+    vocabulary = [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 8))) for _ in range(500)
+    ]
+    base = [[[rng.choice(vocabulary) for _ in range(words)] for _ in range(lines)] for _ in range(parts)]
+    result = {}
+    for doc_pk in range(1, documents + 1):
+        diplomatic = []
+        normalized = []
+        for part in base:
+            diplomatic.append([])
+            normalized.append([])
+            for line in part:
+                line = [rng.choice(vocabulary) if rng.random() < variation else word for word in line]
+                diplomatic[-1].append(" ".join(line))
+                joined = []
+                for word in line:
+                    if joined and rng.random() < drift:
+                        joined[-1] += "-" + word
+                    else:
+                        joined.append(word)
+                normalized[-1].append(" ".join(joined))
+        result[doc_pk] = {"diplomatic": diplomatic, "normalized": normalized, "copy": []}
+    return result
@@ -1,7 +1,736 @@
+# SPDX-FileCopyrightText: 2023-present oeshera <osama.eshera@gmail.com>
+#
+# SPDX-License-Identifier: MIT
+import io
+import json
+import os
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from escriptorium_connector.connector_errors import EscriptoriumConnectorHttpError
+
+from escriptorium_collate import aligner, batch, engine, incremental, order, segment, transcription_layers
+from escriptorium_collate import collate as collate_module
+from escriptorium_collate.cache import TokenCache
+from escriptorium_collate.collate import (
+    CollatexArgs,
+    Witness,
+    collate,
+    get_clustered_collatex_output,
+    get_collatex_input,
+    get_collatex_output,
+    get_segmented_collatex_output,
+    iter_alignment_columns,
+    write_collatex_output_jsonl,
+)
+from escriptorium_collate.fetch import get_part_line_transcriptions, with_retry
+from escriptorium_collate.result import CollationResult
+from escriptorium_collate.server import CollatexServer
+from escriptorium_collate.stats import CollationStats
+from escriptorium_collate.stream import AlignmentColumn, CollatexOutputReader, restore_empty_token
+from escriptorium_collate.tokens import WitnessTokens, tokenize
+from tests.benchmarks import measure_import_time, run_benchmarks
+from tests.fake_escriptorium import FakeEscriptoriumConnector
+
+DOCUMENTS = {
+    1: {
+        "diplomatic": [["a b c", "d e"], ["f g"]],
+        "normalized": [["a b c", "d-e"], ["f g"]],
+    },
+    2: {
+        "diplomatic": [["a x c", "d e"], ["f"]],
+        "normalized": [["a x c", "d e"], ["f"]],
+    },
+}
+
+
+def get_witnesses():
+    return [
+        Witness(
+            doc_pk=doc_pk,
+            siglum=str(doc_pk),
+            diplomatic_transcription_name="diplomatic",
+            normalized_transcription_name="normalized",
+        )
+        for doc_pk in DOCUMENTS
+    ]
+
+
 def test_sum():
     assert sum([1, 2, 3]) == 6, "Should be 6"
 
 
+def test_get_part_line_transcriptions():
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    part = escr.get_document_parts(doc_pk=1).results[0]
+    index = get_part_line_transcriptions(escr=escr, doc_pk=1, part_pk=part.pk)
+    assert len(index) == 2
+    assert all(len(layers) == 2 for layers in index.values())
+    assert escr.calls["get_document_part_transcriptions"] == 1
+
+
+def test_get_collatex_input():
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    input_json = get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs())
+    assert [w["id"] for w in input_json["witnesses"]] == ["1", "2"]
+    tokens = input_json["witnesses"][0]["tokens"]
+    assert sorted(token["n"] for token in tokens[3:5]) == [" ", "d-e"]
+    assert [token["t"] for token in tokens] == ["a", "b", "c", "d", "e", "f", "g"]
+    assert escr.calls["get_document_part_line_transcription_by_transcription"] == 0
+
+
+def test_get_collatex_input_concurrent():
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    serial = get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs())
+    concurrent = get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), max_workers=4)
+    assert concurrent == serial
+
+
+def test_witness_tokens():
+    tokens = WitnessTokens(doc_pk=1, normalized_transcription_pk=2, diplomatic_transcription_pk=3)
+    tokens.append("d", "d-e", 10, 11, 12)
+    tokens.append("e", "", 10, 11, 12)
+    tokens.append("f", None, 13, None, 14)
+    assert tokens.to_json() == [
+        {
+            "t": "d",
+            "n": "d-e",
+            "doc_pk": 1,
+            "line_pk": 10,
+            "normalized_transcription_pk": 2,
+            "normalized_line_transcription_pk": 11,
+            "diplomatic_transcription_pk": 3,
+            "diplomatic_line_transcription_pk": 12,
+        },
+        {
+            "t": "e",
+            "n": " ",
+            "doc_pk": 1,
+            "line_pk": 10,
+            "normalized_transcription_pk": 2,
+            "normalized_line_transcription_pk": 11,
+            "diplomatic_transcription_pk": 3,
+            "diplomatic_line_transcription_pk": 12,
+        },
+        {
+            "t": "f",
+            "doc_pk": 1,
+            "line_pk": 13,
+            "normalized_transcription_pk": None,
+            "normalized_line_transcription_pk": None,
+            "diplomatic_transcription_pk": 3,
+            "diplomatic_line_transcription_pk": 14,
+        },
+    ]
+    columns = json.loads(json.dumps(tokens.to_columns()))
+    assert WitnessTokens.from_columns(columns).to_json() == tokens.to_json()
+
+
+def test_copy_transcription_layers():
+    documents = {
+        doc_pk: {
+            "source": [["a b", "c", "d"], ["e"]],
+            "target": [["a b", "x", ""], []],
+        }
+        for doc_pk in (1, 2)
+    }
+    escr = FakeEscriptoriumConnector(documents)
+    written = transcription_layers.copy_many(
+        escr=escr,
+        doc_pks=[1, 2],
+        source_transcription_layer_name="source",
+        target_transcription_layer_name="target",
+        overwrite=False,
+        batch_size=1,
+    )
+    assert written == {1: 2, 2: 2}
+    assert escr.calls["get_document_part_line_transcription_by_transcription"] == 0
+    assert escr.calls["bulk_update_transcriptions"] == 2
+    assert escr.calls["bulk_create_transcriptions"] == 2
+
+    written = transcription_layers.copy(
+        escr=escr,
+        doc_pk=1,
+        source_transcription_layer_name="source",
+        target_transcription_layer_name="target",
+        overwrite=True,
+    )
+    assert written == 1
+    input_json = get_collatex_input(
+        escr=escr,
+        witnesses=[
+            Witness(
+                doc_pk=1, siglum="1", diplomatic_transcription_name="target", normalized_transcription_name="target"
+            )
+        ],
+        collatex_args=CollatexArgs(),
+    )
+    assert [token["t"] for token in input_json["witnesses"][0]["tokens"]] == ["a", "b", "c", "d", "e"]
+
+
+def test_layer_registry():
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs())
+    get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs())
+    assert escr.calls["get_document_transcriptions"] == 2
+
+    registry = transcription_layers.get_layer_registry(escr)
+    assert transcription_layers.get_layer_registry(escr) is registry
+    pk = transcription_layers.get_transcription_pk_by_name(escr=escr, doc_pk=1, transcription_name="normalized")
+    assert registry.get_layer(doc_pk=1, transcription_pk=pk).name == "normalized"
+    registry.add(1, SimpleNamespace(pk=1000, name="new"))
+    assert registry.get_pk_by_name(doc_pk=1, transcription_name="new") == 1000
+    assert escr.calls["get_document_transcriptions"] == 2
+
+    with pytest.raises(ValueError):
+        registry.get_pk_by_name(doc_pk=1, transcription_name="missing")
+    assert escr.calls["get_document_transcriptions"] == 3
+
+    registry.invalidate(doc_pk=2)
+    registry.load([1, 2])
+    assert escr.calls["get_document_transcriptions"] == 4
+
+
+def test_with_retry():
+    attempts = []
+
+    def flaky(status_code):
+        attempts.append(status_code)
+        if len(attempts) < 3:
+            response = SimpleNamespace(status_code=status_code, headers={})
+            raise EscriptoriumConnectorHttpError("", SimpleNamespace(response=response))
+        return "ok"
+
+    assert with_retry(flaky, 503, backoff_factor=0) == "ok"
+    assert len(attempts) == 3
+
+    attempts.clear()
+    with pytest.raises(EscriptoriumConnectorHttpError):
+        with_retry(flaky, 404, backoff_factor=0)
+    assert len(attempts) == 1
+
+
+def test_token_cache(tmp_path):
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    cache = TokenCache(path=str(tmp_path / "tokens.sqlite3"))
+    first = get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), cache=cache)
+    get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), cache=cache)
+    # Parts without timestamps cannot be told apart once edited: they are only cached with a max_age.
+    assert escr.calls["get_document_part_transcriptions"] == 8
+    assert cache.size() == 0
+
+    cache.max_age = 3600
+    get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), cache=cache)
+    second = get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), cache=cache)
+    assert second == first
+    assert escr.calls["get_document_part_transcriptions"] == 12
+
+    cache.max_age = None
+    for doc_pk in DOCUMENTS:
+        for part in escr.get_document_parts(doc_pk=doc_pk).results:
+            part.updated_at = "2026-01-01T00:00:00Z"
+    get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), cache=cache)
+    get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), cache=cache)
+    assert escr.calls["get_document_part_transcriptions"] == 16
+
+    escr.get_document_parts(doc_pk=1).results[0].updated_at = "2026-01-02T00:00:00Z"
+    get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), cache=cache)
+    assert escr.calls["get_document_part_transcriptions"] == 18
+
+    cache.max_size = 0
+    cache.put("key", 3, 1, 2, [{"t": "a"}])
+    assert cache.get("key") is not None
+    get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(), cache=cache)
+    assert escr.calls["get_document_part_transcriptions"] == 22
+
+
+FAKE_COLLATEX_SERVER = """
+import http.server, json, sys
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        witnesses = sorted(body["witnesses"], key=lambda w: w["id"])
+        width = max((len(w["tokens"]) for w in witnesses), default=0)
+        table = [[w["tokens"][index : index + 1] for w in witnesses] for index in range(width)]
+        out = json.dumps({"witnesses": [w["id"] for w in witnesses], "table": table}).encode()
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(out)
+
+http.server.HTTPServer(("127.0.0.1", int(sys.argv[sys.argv.index("-p") + 1])), Handler).serve_forever()
+"""
+
+
+FAKE_COLLATEX = """
+import json, sys
+
+with open(sys.argv[-1]) as file:
+    witnesses = sorted(json.load(file)["witnesses"], key=lambda w: w["id"])
+width = max((len(w["tokens"]) for w in witnesses), default=0)
+table = [[w["tokens"][index : index + 1] for w in witnesses] for index in range(width)]
+json.dump({"witnesses": [w["id"] for w in witnesses], "table": table}, sys.stdout)
+"""
+
+
+def write_fake_java(tmp_path, source):
+    script = tmp_path / "collatex.py"
+    script.write_text(source)
+    java = tmp_path / "java"
+    java.write_text(f"#!/bin/sh\nexec {sys.executable} {script} \"$@\"\n")
+    java.chmod(java.stat().st_mode | stat.S_IEXEC)
+    return java
+
+
+def test_collatex_server(tmp_path):
+    java = write_fake_java(tmp_path, FAKE_COLLATEX_SERVER)
+
+    server = CollatexServer(java=str(java))
+    input_json = {"witnesses": [{"id": "B", "tokens": [{"t": " "}]}, {"id": "A", "tokens": [{"t": "a"}]}]}
+    try:
+        assert server.collate(input_json)["witnesses"] == ["A", "B"]
+        pid = server._process.pid
+        server._process.kill()
+        server._process.wait()
+        assert server.collate(input_json)["table"] == [[[{"t": "a"}], [{"t": " "}]]]
+        assert server._process.pid != pid
+    finally:
+        server.stop()
+    assert not server.is_running()
+
+
+def test_collatex_output_reader():
+    output = {"witnesses": ["A", "B"], "table": [[[{"t": "a", "n": 1.5}], []], [[{"t": "b"}], [{"t": " "}]]]}
+    reader = CollatexOutputReader(io.StringIO(json.dumps(output, indent=1)), chunk_size=3)
+    assert list(reader) == output["table"]
+    assert reader.witnesses == ["A", "B"]
+    assert list(CollatexOutputReader(io.StringIO('{"table": []}'))) == []
+    reader = CollatexOutputReader(io.StringIO(json.dumps(output)), object_hook=restore_empty_token)
+    assert list(reader)[1] == [[{"t": "b"}], [{"t": ""}]]
+
+
+def test_get_collatex_output_over_pipe(tmp_path, monkeypatch):
+    write_fake_java(tmp_path, FAKE_COLLATEX)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    input_json = get_collatex_input(escr=escr, witnesses=get_witnesses()[::-1], collatex_args=CollatexArgs())
+    stats = CollationStats()
+    output = get_collatex_output(collatex_args=CollatexArgs(), input_json=input_json, stats=stats)
+    assert output["witnesses"] == ["1", "2"]
+    assert [column[0][0]["n"] for column in output["table"]].count("") == 1
+    assert output["table"][-1] == [output["table"][-1][0], []]
+    assert stats.output_columns == 7
+    assert stats.output_chars > 0
+    assert {"collatex", "write_input"} <= set(stats.stages)
+
+
+def make_input(token_comparator="equality", **witnesses):
+    return {
+        "witnesses": [{"id": siglum, "tokens": [{"t": t} for t in text.split()]} for siglum, text in witnesses.items()],
+        "tokenComparator": {"type": token_comparator, "distance": 1},
+    }
+
+
+def render(output):
+    return [
+        [" ".join(token["t"] for token in column[witness_index]) for column in output["table"]]
+        for witness_index in range(len(output["witnesses"]))
+    ]
+
+
+def test_python_engine():
+    input_json = make_input(A="the black cat sat on the mat", B="the cat sat down on a mat")
+    output = engine.collate_input(input_json, tokenized=True)
+    assert output["witnesses"] == ["A", "B"]
+    assert render(output) == [
+        ["the", "black", "cat", "sat", "", "on", "the", "mat"],
+        ["the", "", "cat", "sat", "down", "on", "a", "mat"],
+    ]
+    assert render(engine.collate_input(input_json, tokenized=True, band=2)) == render(output)
+    assert render(engine.collate_input(input_json)) == [
+        ["the", "black", "cat sat", "", "on", "the", "mat"],
+        ["the", "", "cat sat", "down", "on", "a", "mat"],
+    ]
+
+    input_json = make_input("levenshtein", B="thy cats sat", A="the cat sat")
+    output = engine.collate_input(input_json)
+    assert output["witnesses"] == ["A", "B"]
+    assert render(output) == [["the cat sat"], ["thy cats sat"]]
+    input_json["tokenComparator"]["distance"] = 0
+    assert render(engine.collate_input(input_json)) == [["the cat", "sat"], ["thy cats", "sat"]]
+
+    with pytest.raises(ValueError):
+        engine.collate_input({**input_json, "algorithm": "dekker"})
+
+
+def test_python_engine_collatex_args():
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    input_json = get_collatex_input(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs())
+    output = get_collatex_output(collatex_args=CollatexArgs(engine="python"), input_json=input_json)
+    assert output["witnesses"] == ["1", "2"]
+    assert all(len(column) == 2 for column in output["table"])
+    assert all(token["t"] != " " for column in output["table"] for cell in column for token in cell)
+    assert any(token["n"] == " " for witness in input_json["witnesses"] for token in witness["tokens"])
+
+    with pytest.raises(ValueError):
+        get_collatex_output(collatex_args=CollatexArgs(engine="python", algorithm="medite"), input_json=input_json)
+
+
+def test_aligner():
+    assert aligner.align(["a", "b", "d-e", "f"], ["a", "b", "d", "e", "f"]) == (
+        ["a", "b", "", "d-e", "f"],
+        ["a", "b", "d", "e", "f"],
+    )
+    assert aligner.align(["a", "b"], ["a", "b", "b"]) == (["a", "", "b"], ["a", "b", "b"])
+    assert aligner.align(["b", "a"], ["b", "b", "b"]) == (["", "b", "a"], ["b", "b", "b"])
+    pairs = [(["a", "b", "c"], ["a", "b"]), (["x", "y"], ["p", "q", "r", "s"]), ([], ["a"])]
+    aligned = aligner.align_batch(pairs)
+    assert aligned[0] == (["a", "b", "c"], ["a", "b", ""])
+    assert [len(a) == len(b) for a, b in aligned] == [True, True, True]
+    assert [[token for token in a if token] for a, _ in aligned] == [a for a, _ in pairs]
+
+
+def test_segmented_collation(monkeypatch):
+    input_json = make_input(
+        A="a b c one d e f two g h i three j k",
+        B="a c one d x f two g h three i j k",
+        C="a b b one d e two f g h i three j",
+    )
+    anchors = segment.find_anchors(input_json)
+    anchor_tokens = [input_json["witnesses"][0]["tokens"][anchor[0]]["t"] for anchor in anchors]
+    assert anchor_tokens == ["a", "one", "d", "two", "g", "h", "three", "j"]
+    segments = segment.split_input(input_json, segment_size=4)
+    assert [[len(w["tokens"]) for w in s["witnesses"]] for s in segments] == [
+        [4, 3, 4],
+        [4, 4, 4],
+        [4, 4, 4],
+        [2, 2, 1],
+    ]
+
+    tokens = {witness["id"]: [token["t"] for token in witness["tokens"]] for witness in input_json["witnesses"]}
+    for witnesses in (input_json["witnesses"], input_json["witnesses"][::-1]):
+        stats = CollationStats()
+        output = get_segmented_collatex_output(
+            collatex_args=CollatexArgs(engine="python", tokenized=True),
+            input_json={**input_json, "witnesses": witnesses},
+            segment_size=4,
+            max_workers=2,
+            stats=stats,
+        )
+        assert output["witnesses"] == ["A", "B", "C"]
+        assert all(len(column) == 3 for column in output["table"])
+        assert stats.output_columns == len(output["table"])
+        for witness_index, siglum in enumerate(output["witnesses"]):
+            cells = [column[witness_index] for column in output["table"]]
+            assert [token["t"] for cell in cells for token in cell] == tokens[siglum]
+        one = [column[0][0]["t"] if column[0] else None for column in output["table"]].index("one")
+        assert [cell[0]["t"] for cell in output["table"][one]] == ["one", "one", "one"]
+
+    workers = []
+
+    def get_executor(collatex_args, server, max_workers):
+        workers.append(max_workers)
+        return ThreadPoolExecutor(max_workers=max_workers), server
+
+    monkeypatch.setattr(collate_module, "_get_executor", get_executor)
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    collatex_args = CollatexArgs(engine="python")
+    output = collate(escr=escr, witnesses=get_witnesses(), collatex_args=collatex_args, segment_size=2)
+    assert workers == [None]
+    assert output == collate(escr=escr, witnesses=get_witnesses(), collatex_args=collatex_args)
+    collate(escr=escr, witnesses=get_witnesses(), collatex_args=collatex_args, segment_size=2, segment_workers=3)
+    assert workers == [None, 3]
+
+
+def test_collate_incremental(tmp_path, monkeypatch):
+    documents = {
+        1: {"diplomatic": [["a b c", "d e"], ["f g h"], ["i j"]]},
+        2: {"diplomatic": [["a x c", "d e"], ["f h"], ["i j k"]]},
+    }
+    escr = FakeEscriptoriumConnector(documents)
+    witnesses = [
+        Witness(
+            doc_pk=doc_pk,
+            siglum=str(doc_pk),
+            diplomatic_transcription_name="diplomatic",
+            normalized_transcription_name="diplomatic",
+        )
+        for doc_pk in (2, 1)
+    ]
+    collatex_args = CollatexArgs(engine="python", tokenized=True)
+    state_path = str(tmp_path / "state.json")
+
+    collated = []
+
+    def get_collatex_output_spy(**kwargs):
+        collated.append([len(witness["tokens"]) for witness in kwargs["input_json"]["witnesses"]])
+        return get_collatex_output(**kwargs)
+
+    monkeypatch.setattr(incremental, "get_collatex_output", get_collatex_output_spy)
+
+    def run():
+        return incremental.collate_incremental(
+            escr=escr, witnesses=witnesses, collatex_args=collatex_args, state_path=state_path
+        )
+
+    first = run()
+    assert collated == [[10, 10]]
+    assert run() == first
+    assert len(collated) == 1
+
+    part = escr.get_document_parts(doc_pk=1).results[1]
+    escr.get_document_part_transcriptions(doc_pk=1, part_pk=part.pk).results[0].content = "f y h z"
+    second = run()
+    assert collated[1] == [2, 4]
+    input_json = get_collatex_input(escr=escr, witnesses=witnesses, collatex_args=collatex_args)
+    assert render(second) == render(get_collatex_output(collatex_args=collatex_args, input_json=input_json))
+
+
+def test_benchmarks():
+    rows = run_benchmarks(parts=[1], documents=2, lines=3, words=4)
+    assert [row["stage"] for row in rows] == [
+        "get_collatex_input",
+        "get_collatex_output",
+        "collate",
+        "transcription_layers.copy",
+    ]
+    assert all(row["tokens"] == 24 and row["wall_time"] > 0 for row in rows)
+    assert rows[0]["requests"] == rows[2]["requests"] > 0
+    assert rows[1]["requests"] == 0
+
+
+def test_collation_stats():
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    stats = CollationStats(profile=True)
+    collate(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(engine="python"), stats=stats)
+    report = json.loads(stats.to_json())
+    assert {"collate", "get_collatex_input", "tokenize", "align", "python_engine"} <= set(report["stages"])
+    assert report["requests"]["get_document_part_transcriptions"]["count"] == 4
+    assert report["requests"]["get_document_transcriptions"]["count"] == 2
+    assert report["tokens"] == {"1": 7, "2": 6}
+    assert report["output_columns"] > 0
+    assert "collate_input" in stats.get_profile_text()
+
+    for _ in range(3):
+        collate(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(engine="python"))
+        stats = CollationStats()
+        collate(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(engine="python"), stats=stats)
+        assert "get_document_transcriptions" not in stats.requests
+        assert stats.requests["get_document_part_transcriptions"]["count"] == 4
+
+
+def test_run_batch(tmp_path):
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    witnesses = get_witnesses()
+    jobs = [
+        batch.BatchJob(id="both", witnesses=witnesses, collatex_args=CollatexArgs(engine="python")),
+        batch.BatchJob(id="reversed", witnesses=witnesses[::-1], collatex_args=CollatexArgs(engine="python")),
+    ]
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text("\n".join(job.json() for job in jobs))
+    jobs = batch.load_manifest(str(manifest))
+
+    results = batch.run_batch(escr=escr, jobs=jobs, output_dir=str(tmp_path / "out"), max_workers=2)
+    assert results == {"both": None, "reversed": None}
+    assert escr.calls["get_document_part_transcriptions"] == 4
+    with open(tmp_path / "out" / "reversed.json") as file:
+        assert json.load(file)["witnesses"] == ["1", "2"]
+
+    (tmp_path / "out" / "both.json").unlink()
+    assert batch.run_batch(escr=escr, jobs=jobs, output_dir=str(tmp_path / "out"), max_workers=1) == {"both": None}
+    assert batch.run_batch(escr=escr, jobs=jobs, output_dir=str(tmp_path / "out")) == {}
+
+    missing = Witness(doc_pk=1, siglum="3", diplomatic_transcription_name="missing")
+    jobs.append(
+        batch.BatchJob(id="missing", witnesses=[*witnesses, missing], collatex_args=CollatexArgs(engine="python"))
+    )
+    jobs.append(batch.BatchJob(id="first", witnesses=witnesses[:1], collatex_args=CollatexArgs(engine="python")))
+    results = batch.run_batch(escr=escr, jobs=jobs, output_dir=str(tmp_path / "out"), max_workers=1)
+    assert isinstance(results.pop("missing"), ValueError)
+    assert results == {"first": None}
+    assert not (tmp_path / "out" / "missing.json").exists()
+
+
+def test_alignment_columns(tmp_path):
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    collatex_args = CollatexArgs(engine="python", output=str(tmp_path / "output.jsonl"))
+    input_json = get_collatex_input(escr=escr, witnesses=get_witnesses()[::-1], collatex_args=collatex_args)
+    columns = list(iter_alignment_columns(collatex_args=collatex_args, input_json=input_json))
+    output = get_collatex_output(collatex_args=collatex_args, input_json=input_json)
+    assert all(isinstance(column, AlignmentColumn) for column in columns)
+    assert [column.index for column in columns] == list(range(len(output["table"])))
+    assert [list(column.cells) for column in columns] == [["1", "2"]] * len(columns)
+    assert [list(column.cells.values()) for column in columns] == output["table"]
+
+    assert collate(escr=escr, witnesses=get_witnesses(), collatex_args=collatex_args, jsonl=True) is None
+    with open(collatex_args.output) as file:
+        lines = [json.loads(line) for line in file]
+    assert lines == [column._asdict() for column in columns]
+    assert all(token["t"] != " " for line in lines for cell in line["cells"].values() for token in cell)
+
+    assert write_collatex_output_jsonl(collatex_args=collatex_args, input_json=input_json) == len(columns)
+    with open(collatex_args.output) as file:
+        assert [json.loads(line) for line in file] == lines
+
+
+def test_collation_result(tmp_path):
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    collatex_args = CollatexArgs(engine="python", tokenized=True)
+    output = collate(escr=escr, witnesses=get_witnesses(), collatex_args=collatex_args)
+    result = CollationResult(output)
+    # a b|x c d-e|d e|e f g|-
+    assert result.variant_columns.tolist() == [1, 3, 4, 6]
+    assert result.get_agreement("1", "2") == 3
+    assert result.get_agreement("1", "1") == 7
+    assert result.get_readings(1) == {("b",): ["1"], ("x",): ["2"]}
+    assert result.get_readings(6) == {("g",): ["1"], (): ["2"]}
+    assert result.get_variant_columns(doc_pk=2).tolist() == [1, 3, 4]
+
+    line_pks = {token["t"]: token["line_pk"] for column in output["table"] for token in column[1]}
+    assert result.get_line_columns(line_pks["x"]).tolist() == [0, 1, 2]
+    assert result.get_divergent_witnesses(line_pks["x"]) == ["1"]
+    assert result.get_divergent_witnesses(line_pks["f"]) == []
+    assert result.get_variant_columns(line_pks=[line_pks["x"], line_pks["f"]]).tolist() == [1]
+    assert result.get_column("1", 4) == 4
+    with pytest.raises(IndexError):
+        result.get_column("2", 6)
+
+    collatex_args = CollatexArgs(engine="python", tokenized=True, output=str(tmp_path / "output.jsonl"))
+    collate(escr=escr, witnesses=get_witnesses(), collatex_args=collatex_args, jsonl=True)
+    assert (CollationResult.from_file(collatex_args.output).agreement == result.agreement).all()
+
+
+def test_write_back():
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    output = collate(escr=escr, witnesses=get_witnesses(), collatex_args=CollatexArgs(engine="python", tokenized=True))
+    assert transcription_layers.get_line_contents(output, gap="[-]")[2] == {17: "a x c", 20: "d e", 24: "f [-]"}
+
+    create = escr.bulk_create_transcriptions
+    failures = []
+
+    def flaky_create(doc_pk, part_pk, transcriptions):
+        # Applied, but reported as failed once: the retry must not create duplicates.
+        create(doc_pk=doc_pk, part_pk=part_pk, transcriptions=transcriptions)
+        if not failures:
+            failures.append(part_pk)
+            response = SimpleNamespace(status_code=429, headers={"Retry-After": "0"})
+            raise EscriptoriumConnectorHttpError("", SimpleNamespace(response=response))
+
+    escr.bulk_create_transcriptions = flaky_create
+    written = transcription_layers.write_back(
+        escr=escr,
+        collatex_output=output,
+        target_transcription_layer_name="collated",
+        render=lambda token, column: token["t"].upper(),
+        gap="[-]",
+        max_workers=1,
+    )
+    assert written == {1: 3, 2: 3}
+    assert escr.calls["create_document_transcription"] == 2
+    assert escr.calls["bulk_create_transcriptions"] == 4
+
+    witness = Witness(doc_pk=2, siglum="2", diplomatic_transcription_name="collated")
+    input_json = get_collatex_input(escr=escr, witnesses=[witness], collatex_args=CollatexArgs())
+    assert [token["t"] for token in input_json["witnesses"][0]["tokens"]] == ["A", "X", "C", "D", "E", "F", "[-]"]
+
+    written = transcription_layers.write_back(
+        escr=escr, collatex_output=output, target_transcription_layer_name="collated", gap="[-]"
+    )
+    assert written == {1: 3, 2: 3}
+    assert escr.calls["bulk_update_transcriptions"] == 4
+    assert transcription_layers.write_back(
+        escr=escr, collatex_output=output, target_transcription_layer_name="collated", gap="[-]"
+    ) == {1: 0, 2: 0}
+
+    get_transcriptions = escr.get_document_part_transcriptions
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def slow_get_transcriptions(doc_pk, part_pk):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return get_transcriptions(doc_pk=doc_pk, part_pk=part_pk)
+
+    escr.get_document_part_transcriptions = slow_get_transcriptions
+    transcription_layers.write_back(
+        escr=escr, collatex_output=output, target_transcription_layer_name="x", max_workers=2
+    )
+    assert in_flight[1] == 2
+
+
+def test_order_witnesses():
+    base = "in principio erat verbum et verbum erat apud deum et deus erat verbum".split()
+    other = "hoc erat in principio apud deum omnia per ipsum facta sunt et sine ipso".split()
+    texts = {
+        "A": base,
+        "C": other,
+        "B": base[:5] + ["sermo"] + base[6:],
+        "D": other[:-1],
+        "E": [],
+    }
+    input_json = {
+        "witnesses": [{"id": siglum, "tokens": [{"t": word} for word in text]} for siglum, text in texts.items()]
+    }
+    sketches = order.get_minhash_sketches(input_json)
+    similarity = order.get_similarity_matrix(sketches)
+    assert similarity[0, 2] > 0.5 and similarity[1, 3] > 0.5
+    assert similarity[0, 1] < 0.2 and similarity[4].max() == 0
+
+    assert [witness["id"] for witness in order.order_witnesses(input_json)["witnesses"]][:4] in (
+        ["A", "B", "C", "D"],
+        ["C", "D", "A", "B"],
+    )
+    clusters = order.cluster_witnesses(input_json, threshold=0.5)
+    assert sorted(sorted(witness["id"] for witness in cluster["witnesses"]) for cluster in clusters) == [
+        ["A", "B"],
+        ["C", "D"],
+        ["E"],
+    ]
+    outputs = get_clustered_collatex_output(
+        collatex_args=CollatexArgs(engine="python"), input_json=input_json, threshold=0.5, max_workers=2
+    )
+    assert sorted(sorted(output["witnesses"]) for output in outputs) == [["A", "B"], ["C", "D"], ["E"]]
+
+    escr = FakeEscriptoriumConnector(DOCUMENTS)
+    witnesses = get_witnesses()[::-1]
+    ordered = collate(escr=escr, witnesses=witnesses, collatex_args=CollatexArgs(engine="python"), order_witnesses=True)
+    assert ordered["witnesses"] == ["1", "2"]
+    output = collate(escr=escr, witnesses=witnesses, collatex_args=CollatexArgs(engine="python"))
+    assert render(ordered) == render(output)
+
+
+def test_lazy_imports():
+    assert tokenize(" a\tb\u00a0c\n\nd ") == ["a", "b", "c", "d"]
+    rows = measure_import_time(modules=("escriptorium_collate.collate", "escriptorium_collate.batch"), runs=1)
+    assert all(row["heavy_modules"] == [] and row["import_time"] > 0 for row in rows)
+
+
 if __name__ == "__main__":
     test_sum()
+    test_get_part_line_transcriptions()
+    test_get_collatex_input()
+    test_get_collatex_input_concurrent()
+    test_witness_tokens()
+    test_copy_transcription_layers()
+    test_layer_registry()
+    test_with_retry()
+    test_collatex_output_reader()
+    test_python_engine()
+    test_python_engine_collatex_args()
+    test_aligner()
+    test_segmented_collation()
+    test_benchmarks()
+    test_collation_stats()
+    test_write_back()
+    test_order_witnesses()
+    test_lazy_imports()
     print("Everything passed")